@@ -7,11 +7,13 @@
 import framebuf
 import machine
 import utime
+from array import array
 # 8-bit color driver for 0.96 inch OLED
 from ssd1331 import SSD1331
 # Optional 16-bit color driver
 # from ssd1331_16bit import SSD1331
 from mapper import Mapper  # Maps temperature to rgb color
+import render  # Fast image drawing
 from amg88xx import AMG88XX
 
 # For timer callback demo:
@@ -32,6 +34,7 @@ spi = machine.SPI(1)
 ssd = SSD1331(spi, pcs, pdc, prst)
 ssd.fill(0)
 ssd.show()
+mapper.set_rgb(ssd.rgb)  # Enable native colors
 
 # Instantiate temperature sensor
 i2c = machine.I2C(1)
@@ -49,8 +52,9 @@ col = 80
 val = TMIN
 dt = (TMAX - TMIN) / 32
 for row in range(63, -1, -2):
-    ssd.fill_rect(col, row, 15, 2, ssd.rgb(*mapper(int(val))))
+    ssd.fill_rect(col, row, 15, 2, mapper.native(val))
     val += dt
+ssd.dirty(col, 0, 15, 64)  # Send the scale with the first frame
 
 # Coordinate mapping from sensor to screen
 invert = True  # For my breadboard layout
@@ -58,16 +62,24 @@ reflect = True
 transpose = True
 print('Temperature {:5.1f}°C'.format(sensor.temperature()))
 
+temps = array('f', (0 for _ in range(64)))  # Sensor frame
+# Native colors: the 16 bit driver needs 16 bit elements.
+colors = bytearray(64) if ssd.mode == framebuf.GS8 else array('H', (0 for _ in range(64)))
+
 # Run the camera
 while True:
     sensor.refresh()  # Acquire data
+    i = 0
     for row in range(8):
         for col in range(8):
             r = 7 - row if invert else row
             c = 7 - col if reflect else col
             if transpose:
                 r, c = c, r
-            val = sensor[r, c]
-            ssd.fill_rect(col * 8, row * 8, 8, 8, ssd.rgb(*mapper(val)))
+            temps[i] = sensor[r, c]
+            i += 1
+    mapper.map_into(temps, colors)
+    render.blit(ssd, colors, 8, 8, 8, 0, 0)  # Each pixel is 8x8
+    ssd.dirty(0, 0, 64, 64)  # Only the image has changed
     ssd.show()
     utime.sleep(0.2)
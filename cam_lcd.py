@@ -5,9 +5,12 @@
 # Copyright (c) Peter Hinch 2019
 
 import lcd160cr
+import framebuf
 import machine
 import utime
+from array import array
 from mapper import Mapper  # Maps temperature to rgb color
+import render  # Fast image drawing
 from amg88xx import AMG88XX
 
 # Temperature range to cover
@@ -21,6 +24,7 @@ mapper = Mapper(TMIN, TMAX)
 lcd = lcd160cr.LCD160CR('Y')
 lcd.set_pen(0, 0)
 lcd.erase()
+mapper.set_rgb(lcd.rgb)  # Enable native colors
 
 # Instantiate temperature sensor
 i2c = machine.I2C(1)
@@ -32,7 +36,7 @@ col = 80
 val = TMIN
 dt = (TMAX - TMIN) / 32
 for row in range(63, -1, -2):
-    color = lcd.rgb(*mapper(val))
+    color = mapper.native(val)
     lcd.set_pen(color, color)
     lcd.rect(col, row, 15, 2)
     val += dt
@@ -43,16 +47,36 @@ reflect = True
 transpose = True
 print('Temperature {:5.1f}°C'.format(sensor.temperature()))
 
+# The image is rendered into a local buffer and sent to the display in a
+# single transfer: drawing each cell with set_pen and rect needs two commands
+# per cell. render.blit needs an object with these attributes.
+class Image:
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.mode = framebuf.RGB565  # Native format of the LCD160CR
+        self.buffer = bytearray(width * height * 2)
+
+image = Image(64, 64)
+temps = array('f', (0 for _ in range(64)))  # Sensor frame
+colors = array('H', (0 for _ in range(64)))  # Native colors
+
 # Run the camera
 white = lcd.rgb(255, 255, 255)
 black = lcd.rgb(0, 0, 0)
 lcd.set_font(3)
 lcd.set_text_color(white, black)
+lcd.set_pos(0, 70)
+lcd.write('Temperatures')
+# Text is only written when a value changes
+fields = (('Max:{:4d}C', 85), ('Min:{:4d}C', 100), ('Avg:{:4d}C', 115))
+values = [None, None, None]
 while True:
     sensor.refresh()  # Acquire data
     max_t = -1000
     min_t = 1000
     sum_t = 0
+    i = 0
     for row in range(8):
         for col in range(8):
             r = 7 - row if invert else row
@@ -63,15 +87,16 @@ while True:
             max_t = max(max_t, val)
             min_t = min(min_t, val)
             sum_t += val
-            color = lcd.rgb(*mapper(val))
-            lcd.set_pen(color, color)
-            lcd.rect(col * 8, row * 8, 8, 8)
-    lcd.set_pos(0, 70)
-    lcd.write('Temperatures')
-    lcd.set_pos(0, 85)
-    lcd.write('Max:{:4d}C'.format(max_t))
-    lcd.set_pos(0, 100)
-    lcd.write('Min:{:4d}C'.format(min_t))
-    lcd.set_pos(0, 115)
-    lcd.write('Avg:{:4d}C'.format(round(sum_t / 64)))
+            temps[i] = val
+            i += 1
+    mapper.map_into(temps, colors)
+    render.blit(image, colors, 8, 8, 8, 0, 0)  # Each pixel is 8x8
+    lcd.set_spi_win(0, 0, 64, 64)
+    lcd.show_framebuf(image.buffer)
+    for n, val in enumerate((max_t, min_t, round(sum_t / 64))):
+        if val != values[n]:
+            values[n] = val
+            fmt, y = fields[n]
+            lcd.set_pos(0, y)
+            lcd.write(fmt.format(val))
     utime.sleep(0.2)
@@ -0,0 +1,190 @@
+# headless.py Display without hardware for profiling and regression tests.
+# Runs on any MicroPython port with framebuf, including the Unix port.
+
+# Released under the MIT licence.
+# Copyright (c) Peter Hinch 2019
+
+# Headless has the interface of the SSD1331 and SSD1351 drivers. Nothing is
+# sent anywhere: show() counts the bytes which would be sent over SPI,
+# including commands, and the time this would take at a given baudrate.
+# Frames may be written to PPM files which can be viewed or compared with
+# reference images.
+# Usage:
+# import framebuf
+# from headless import Headless
+# ssd = Headless(64, 96)  # Emulate SSD1331
+# ssd = Headless(128, 128, framebuf.RGB565, 11_000_000)  # Emulate SSD1351
+# ... draw and ssd.show() as usual
+# print(ssd.stats())
+# ssd.dump('frame.ppm')
+
+import framebuf
+import utime
+import uasyncio as asyncio
+
+_NRECTS = 4  # Marked regions before they are merged
+_CMD = 6  # Command bytes to set an address window
+
+class Headless(framebuf.FrameBuffer):
+    # Color conversion as per SSD1331 (rrrgggbb)
+    @staticmethod
+    def rgb8(r, g, b):
+        return (r & 0xe0) | ((g >> 3) & 0x1c) | (b >> 6)
+
+    # Color conversion as per SSD1351 (RGB565 in hardware byte order)
+    @staticmethod
+    def rgb16(r, g, b):
+        return ((r & 0xf8) << 5) | ((g & 0x1c) << 11) | (b & 0xf8) | ((g & 0xe0) >> 5)
+
+    # If realtime is True show() and show_async() take as long as the real
+    # transfer would. If ppm is a format string such as 'frame{:04d}.ppm',
+    # each frame is written to a file.
+    def __init__(self, height=64, width=96, mode=framebuf.GS8, rate=6_660_000,
+                 realtime=False, ppm=None):
+        if mode not in (framebuf.GS8, framebuf.RGB565):
+            raise ValueError('Unsupported mode.')
+        self.height = height  # Required by Writer class
+        self.width = width
+        self.mode = mode
+        self.rate = rate
+        self.rgb = self.rgb8 if mode == framebuf.GS8 else self.rgb16
+        self._bpp = 1 if mode == framebuf.GS8 else 2
+        self.buffer = bytearray(height * width * self._bpp)
+        super().__init__(self.buffer, width, height, mode)
+        self.mvb = memoryview(self.buffer)
+        self._realtime = realtime
+        self._ppm = ppm
+        self._rects = []  # x0, y0, x1, y1
+        self._busy = False
+        self.reset()
+
+    # Clear statistics.
+    def reset(self):
+        self.frames = 0
+        self.nbytes = 0
+        self.time_us = 0  # Simulated transfer time
+
+    # Return frames shown, bytes sent and simulated transfer time in μs.
+    def stats(self):
+        return self.frames, self.nbytes, self.time_us
+
+    def _us(self, nbytes):
+        return nbytes * 8_000_000 // self.rate
+
+    # Account for sending a window of w * h pixels.
+    def _send(self, w, h):
+        n = _CMD + w * h * self._bpp
+        self.nbytes += n
+        self.time_us += self._us(n)
+        return n
+
+    # Regions are merged into their bounding box when more than _NRECTS are
+    # marked. The drivers merge more selectively so the byte count is an upper
+    # bound when many regions are marked.
+    def dirty(self, x, y, w, h):
+        x0 = max(x, 0)
+        y0 = max(y, 0)
+        x1 = min(x + w, self.width) - 1
+        y1 = min(y + h, self.height) - 1
+        if x1 < x0 or y1 < y0:
+            return
+        rects = self._rects
+        rects.append((x0, y0, x1, y1))
+        if len(rects) > _NRECTS:
+            r = (min(r[0] for r in rects), min(r[1] for r in rects),
+                 max(r[2] for r in rects), max(r[3] for r in rects))
+            rects.clear()
+            rects.append(r)
+
+    def _regions(self):
+        regions = self._rects if self._rects else [(0, 0, self.width - 1, self.height - 1)]
+        self._rects = []
+        return regions
+
+    def _frame(self):
+        self.frames += 1
+        if self._ppm is not None:
+            self.dump(self._ppm.format(self.frames))
+
+    # As per the drivers, copy w * h pixels in native format to the window at
+    # x, y. The framebuf is updated so that frames may be dumped.
+    def write_window(self, x, y, w, h, buf):
+        if self._busy:
+            raise RuntimeError('Asynchronous transfer in progress.')
+        bpp = self._bpp
+        row = w * bpp
+        for r in range(h):
+            start = ((y + r) * self.width + x) * bpp
+            self.mvb[start : start + row] = memoryview(buf)[r * row : (r + 1) * row]
+        n = self._send(w, h)
+        if self._realtime:
+            utime.sleep_us(self._us(n))
+
+    def busy(self):
+        return self._busy
+
+    async def wait(self):
+        while self._busy:
+            await asyncio.sleep_ms(0)
+
+    def show(self):
+        if self._busy:
+            raise RuntimeError('Asynchronous transfer in progress.')
+        n = 0
+        for x0, y0, x1, y1 in self._regions():
+            n += self._send(x1 - x0 + 1, y1 - y0 + 1)
+        if self._realtime:
+            utime.sleep_us(self._us(n))
+        self._frame()
+
+    # With realtime set, the simulated transfer is paced in chunks with other
+    # tasks running between them, as per the drivers without double buffering.
+    async def show_async(self, chunk=1024):
+        await self.wait()
+        self._busy = True
+        try:
+            for x0, y0, x1, y1 in self._regions():
+                n = self._send(x1 - x0 + 1, y1 - y0 + 1)
+                while n > 0:
+                    if self._realtime:
+                        await asyncio.sleep_ms(self._us(min(n, chunk)) // 1000)
+                    else:
+                        await asyncio.sleep_ms(0)
+                    n -= chunk
+        finally:
+            self._busy = False
+        self._frame()
+
+    # Return r, g, b of the pixel at x, y.
+    def rgb_at(self, x, y):
+        i = y * self.width + x
+        if self._bpp == 1:
+            v = self.buffer[i]
+            return v & 0xe0, (v << 3) & 0xe0, (v << 6) & 0xc0
+        v = self.buffer[2 * i] | (self.buffer[2 * i + 1] << 8)
+        return (v >> 5) & 0xf8, ((v & 7) << 5) | ((v >> 11) & 0x1c), v & 0xf8
+
+    # Write the framebuf to a binary PPM file.
+    def dump(self, fn):
+        row = bytearray(self.width * 3)
+        with open(fn, 'wb') as f:
+            f.write('P6\n{} {}\n255\n'.format(self.width, self.height).encode())
+            for y in range(self.height):
+                for x in range(self.width):
+                    row[3 * x], row[3 * x + 1], row[3 * x + 2] = self.rgb_at(x, y)
+                f.write(row)
+
+    # Compare the framebuf with a PPM file written by dump(). Return the
+    # number of pixels which differ.
+    def compare(self, fn):
+        with open(fn, 'rb') as f:
+            hdr = f.readline() + f.readline() + f.readline()
+            if hdr != 'P6\n{} {}\n255\n'.format(self.width, self.height).encode():
+                raise ValueError('Image size differs from display.')
+            ndiff = 0
+            for y in range(self.height):
+                row = f.read(self.width * 3)
+                for x in range(self.width):
+                    if tuple(row[3 * x : 3 * x + 3]) != self.rgb_at(x, y):
+                        ndiff += 1
+        return ndiff
@@ -6,11 +6,14 @@
 
 import framebuf
 import machine
+from array import array
 from ssd1331 import SSD1331  # Driver for 0.96 inch OLED
 from mapper import Mapper  # Maps temperature to rgb color
+import render  # Fast image drawing
 from amg88xx import AMG88XX
-# from interpolate import Interpolator  # Portable version
-from interpolate_a import Interpolator  # STM assembler version
+# Uses the fastest interpolator which works on this platform. To force a
+# backend, pass e.g. 'python' as a second arg to Interpolator.
+from interpolator import Interpolator
 
 # Temperature range to cover
 TMAX = 30
@@ -27,6 +30,7 @@ spi = machine.SPI(1)
 ssd = SSD1331(spi, pcs, pdc, prst)
 ssd.fill(0)
 ssd.show()
+mapper.set_rgb(ssd.rgb)  # Enable native colors
 
 # Instantiate temperature sensor
 i2c = machine.I2C(1)
@@ -39,8 +43,9 @@ col = 80
 val = TMIN
 dt = (TMAX - TMIN) / 32
 for row in range(63, -1, -2):
-    ssd.fill_rect(col, row, 15, 2, ssd.rgb(*mapper(int(val))))
+    ssd.fill_rect(col, row, 15, 2, mapper.native(val))
     val += dt
+ssd.dirty(col, 0, 15, 64)  # Send the scale with the first frame
 
 # Coordinate mapping from sensor to screen
 invert = True  # For my breadboard layout
@@ -48,9 +53,15 @@ reflect = True
 transpose = True
 print('Temperature {:5.1f}°C'.format(sensor.temperature()))
 
+# Ordered dithering improves the color depth of the 8 bit display.
+dlut = mapper.dither_lut()
+temps = array('f', (0 for _ in range(1024)))  # Interpolated frame
+colors = bytearray(1024)  # Color numbers
+
 # Run the camera
 while True:
     interpolator.refresh()  # Acquire data from sensor via interpolator.
+    i = 0
     for row in range(32):
         for col in range(32):
             r = 31 - row if invert else row
@@ -58,6 +69,9 @@ while True:
             if transpose:
                 r, c = c, r
             # For interpolator 0.0 <= row <= 1.0, 0.0 <= col <= 1.0
-            val = interpolator(r/31, c/31)
-            ssd.fill_rect(col * 2, row * 2, 2, 2, ssd.rgb(*mapper(val)))
+            temps[i] = interpolator(r/31, c/31)
+            i += 1
+    mapper.map_into(temps, colors, False)
+    render.dither(ssd, colors, 32, 32, 2, 0, 0, dlut)
+    ssd.dirty(0, 0, 64, 64)  # Only the image has changed
     ssd.show()
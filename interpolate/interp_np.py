@@ -0,0 +1,112 @@
+# interp_np.py Batch bicubic interpolation of recorded AMG8833 frames.
+# Runs under CPython with NumPy, not on MicroPython.
+
+# Released under the MIT licence.
+# Copyright (c) Peter Hinch 2019
+
+# Frames are extrapolated to 10x10 exactly as in interpolate.py and the same
+# cubic is used. Because the cubic is linear in the samples, interpolating a
+# frame P reduces to Wy @ P @ Wx.T where Wy and Wx hold the four kernel weights
+# for each output row and column. These are computed once for a given output
+# size so a batch of frames costs two matrix multiplies.
+# Usage:
+# import numpy as np
+# from interp_np import upsample
+# images = upsample(frames, 32, 32)  # frames.shape == (N, 8, 8)
+# python3 interp_np.py  # Check against interpolate_p.py and measure throughput
+
+import numpy as np
+
+# As per interpolate.py: coordinate 0.0..1.0 maps to 0..6.99 on the sensor.
+_SPAN = 6.99
+
+# Kernel weights of interp_arr for offset x: the result is sum(w[k] * p[k]).
+def _weights(x):
+    x2 = x * x
+    x3 = x2 * x
+    return np.stack((0.5 * (-x + 2 * x2 - x3),
+                     1.0 + 0.5 * (-5 * x2 + 3 * x3),
+                     0.5 * (x + 4 * x2 - 3 * x3),
+                     0.5 * (x3 - x2)), axis=-1)
+
+# Return an (n, 10) matrix mapping a padded axis to n interpolated points.
+def _matrix(n):
+    pos = np.linspace(0.0, 1.0, n) * _SPAN if n > 1 else np.zeros(1)
+    base = np.floor(pos).astype(int)
+    w = _weights(pos - base)
+    m = np.zeros((n, 10))
+    for k in range(4):
+        m[np.arange(n), base + k] = w[:, k]
+    return m
+
+# Extrapolate 1 pixel at each edge: (N, 8, 8) -> (N, 10, 10).
+def pad(frames):
+    f = np.asarray(frames, dtype=np.float64)
+    p = np.empty(f.shape[:-2] + (10, 10))
+    p[..., 1:9, 1:9] = f
+    p[..., 0, 0] = 2 * p[..., 1, 1] - p[..., 2, 2]
+    p[..., 0, 9] = 2 * p[..., 1, 8] - p[..., 2, 7]
+    p[..., 9, 0] = 2 * p[..., 8, 1] - p[..., 7, 2]
+    p[..., 9, 9] = 2 * p[..., 8, 8] - p[..., 7, 7]
+    p[..., 1:9, 0] = 2 * p[..., 1:9, 1] - p[..., 1:9, 2]
+    p[..., 1:9, 9] = 2 * p[..., 1:9, 8] - p[..., 1:9, 7]
+    p[..., 0, 1:9] = 2 * p[..., 1, 1:9] - p[..., 2, 1:9]
+    p[..., 9, 1:9] = 2 * p[..., 8, 1:9] - p[..., 7, 1:9]
+    return p
+
+# Upsample an (N, 8, 8) array of frames to (N, height, width). Row and column
+# i of the output correspond to Interpolator coordinate i/(height - 1) etc.
+# Frames are processed in chunks small enough for the temporaries to stay in
+# cache: this is several times faster than large chunks.
+def upsample(frames, height=32, width=32, dtype=np.float32, chunk=4096):
+    frames = np.asarray(frames)
+    if frames.shape[-2:] != (8, 8):
+        raise ValueError('Frames must be 8x8, not {}'.format(frames.shape[-2:]))
+    wy = _matrix(height)
+    wxt = _matrix(width).T
+    out = np.empty(frames.shape[:-2] + (height, width), dtype=dtype)
+    flat = frames.reshape(-1, 8, 8)
+    res = out.reshape(-1, height, width)
+    for start in range(0, len(flat), chunk):
+        res[start:start + chunk] = wy @ pad(flat[start:start + chunk]) @ wxt
+    return out
+
+# Run the device code (interpolate_p.py) on the same frames and return the
+# largest absolute difference.
+def check(frames, height=32, width=32):
+    import os
+    fn = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'interpolate_p.py')
+    g = {'const': lambda x: x}  # Provided by the MicroPython compiler
+    with open(fn) as f:
+        exec(f.read(), g)
+
+    class Sensor:
+        frame = None
+        def refresh(self, _=None):
+            pass
+        def __getitem__(self, index):
+            return self.frame[index]
+
+    sensor = Sensor()
+    interp = g['Interpolator'](sensor)
+    ours = upsample(frames, height, width)
+    err = 0.0
+    for frame, img in zip(frames, ours):
+        sensor.frame = frame
+        interp.refresh()
+        for row in range(height):
+            for col in range(width):
+                dev = interp(row / (height - 1), col / (width - 1))
+                err = max(err, abs(dev - img[row, col]))
+    return err
+
+if __name__ == '__main__':
+    import time
+    rng = np.random.default_rng(1)
+    frames = rng.integers(0, 80, size=(20, 8, 8))
+    print('Max error vs interpolate_p.py: {:.2e}'.format(check(frames)))
+    frames = rng.integers(0, 80, size=(200000, 8, 8)).astype(np.float32)
+    t = time.perf_counter()
+    upsample(frames)
+    dt = time.perf_counter() - t
+    print('32x32 throughput: {:.0f} frames/s'.format(len(frames) / dt))
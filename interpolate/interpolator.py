@@ -0,0 +1,117 @@
+# interpolator.py Runtime selection of bicubic interpolator for AMG8833
+
+# Released under the MIT licence.
+# Copyright (c) Peter Hinch 2019
+
+# Each backend module provides the same Interpolator class. This module finds
+# out which code emitters the firmware supports, discards backends which fail
+# to load or which produce wrong results, and uses the fastest survivor.
+# Usage:
+# from interpolator import Interpolator
+# interp = Interpolator(sensor)  # Fastest working backend
+# interp = Interpolator(sensor, 'python')  # Override
+
+import sys
+from utime import ticks_us, ticks_diff
+
+# Backends in order of decreasing speed. Only modules which are tried are
+# imported: a backend which fails is removed from sys.modules to save RAM. The viper backend also uses the
+# native emitter: MicroPython enables both or neither.
+_BACKENDS = (('asm', 'interpolate_a', 'asm_thumb'),
+             ('viper', 'interpolate', 'viper'),
+             ('python', 'interpolate_p', None))
+
+# Source which only compiles if the emitter is supported.
+_PROBES = (('asm_thumb', '@micropython.asm_thumb\ndef f(r0):\n    add(r0, r0, 1)\n'),
+           ('viper', '@micropython.viper\ndef f(x:int) -> int:\n    return x + 1\n'),
+           ('native', '@micropython.native\ndef f(x):\n    return x + 1\n'))
+
+def _compiles(src):
+    try:
+        exec(src)
+    except Exception:  # SyntaxError or ValueError depending on port
+        return False
+    return True
+
+# Emitters supported by this firmware, determined at import.
+EMITTERS = tuple(name for name, src in _PROBES if _compiles(src))
+
+# Stands in for an AMG88XX when testing backends. Values are arbitrary but
+# irregular so that an incorrect implementation is unlikely to pass.
+class _Dummy:
+    def refresh(self, _=None):
+        pass
+
+    def __getitem__(self, index):
+        r, c = index
+        return (r * r * 3 + c * 7 + r * c) % 23 + 15
+
+_POINTS = ((0.0, 0.0), (0.13, 0.71), (0.5, 0.5), (0.77, 0.29), (1.0, 1.0))
+# Results of the portable backend at _POINTS.
+_EXPECTED = (15.0, 35.006, 26.8599, 26.9485, 29.8586)
+
+def _values(interp):
+    interp.refresh()
+    return [interp(r, c) for r, c in _POINTS]
+
+_cls = {}  # name: Interpolator class for backends which work
+
+def _load(name):
+    if name not in _cls:
+        for bname, mod, emitter in _BACKENDS:
+            if bname == name:
+                break
+        else:
+            raise ValueError('Unknown backend {}'.format(name))
+        if emitter is not None and emitter not in EMITTERS:
+            return None
+        try:
+            cls = __import__(mod).Interpolator
+            res = _values(cls(_Dummy()))
+        except Exception:  # e.g. asm_thumb on a chip without FPU
+            res = None
+        if res is None or any(abs(a - b) > 0.01 for a, b in zip(_EXPECTED, res)):
+            if mod in sys.modules:
+                del sys.modules[mod]
+            return None
+        _cls[name] = cls
+    return _cls[name]
+
+# Return names of working backends, fastest first. For reporting: this loads
+# every backend.
+def backends():
+    return [name for name, _, _ in _BACKENDS if _load(name) is not None]
+
+# Return an Interpolator instance using the named or fastest working backend.
+# The .backend attribute holds the name of the backend in use.
+def Interpolator(sensor, backend=None):
+    if backend is None:  # Load backends until one works
+        for name, _, _ in _BACKENDS:
+            cls = _load(name)
+            if cls is not None:
+                break
+    else:
+        name = backend
+        cls = _load(name)
+        if cls is None:
+            raise ValueError('Backend {} is not supported on this platform'.format(name))
+    interp = cls(sensor)
+    interp.backend = name
+    return interp
+
+# Time a full frame (refresh plus rows * cols lookups). Uses the sensor if
+# one is passed, otherwise times interpolation alone. Returns the backend name
+# and the mean frame time in ms.
+def bench(sensor=None, backend=None, rows=32, cols=32, nframes=5):
+    interp = Interpolator(_Dummy() if sensor is None else sensor, backend)
+    mr = rows - 1
+    mc = cols - 1
+    t = ticks_us()
+    for _ in range(nframes):
+        interp.refresh()
+        for row in range(rows):
+            for col in range(cols):
+                interp(row/mr, col/mc)
+    dt = ticks_diff(ticks_us(), t) / (nframes * 1000)
+    print('Backend: {} Emitters: {} Frame time: {:6.1f}ms'.format(interp.backend, EMITTERS, dt))
+    return interp.backend, dt
@@ -3,24 +3,347 @@
 # Released under the MIT licence.
 # Copyright (c) Peter Hinch 2019
 
+from array import array
+from micropython import const
+
+# Temperatures are converted to fixed point with 8 fractional bits (1/256°C),
+# rounded to nearest, for bulk mapping.
+_FRAC = 8
+# Automatic gain control uses a histogram of 0.25°C bins covering -20°C to
+# 108°C.
+_BINS = const(512)
+_AGC_LO = const(-5120)  # -20°C with _FRAC fractional bits
+# Fractional bits of the scale factor for linear mapping. The product of the
+# factor and a temperature difference is at most about ncolors << _SHIFT so
+# this is the most which fits a 32 bit signed int with 255 colors.
+_SHIFT = const(23)
+
+# Bulk map an array of floats to color numbers or native colors. Floats are
+# decoded from their bit pattern so that no float objects are created: the
+# function does not allocate. Viper allows only 4 args so the others are
+# passed in par: n, tmin, tmax, factor, ncolors, wide dst, use lut, shift.
+# tmin and tmax have _FRAC fractional bits, factor has shift fractional bits.
+@micropython.viper
+def _map(src, dst, lut, par):
+    s = ptr32(src)
+    p = ptr32(par)
+    n = p[0]
+    tmin = p[1]
+    tmax = p[2]
+    fac = p[3]
+    top = p[4]
+    wide = p[5]
+    uselut = p[6]
+    shift = p[7]
+    rnd = 1 << (shift - 1)
+    d8 = ptr8(dst)
+    d16 = ptr16(dst)
+    lu = ptr16(lut)
+    for i in range(n):
+        b = int(s[i])
+        e = (b >> 23) & 0xff  # Biased exponent
+        if e < 118:  # abs(t) < 1/512 (includes 0.0)
+            v = 0
+        elif e > 141:  # abs(t) >= 32768: will be clipped
+            v = 0x10000000
+        else:
+            v = (b & 0x7fffff) | 0x800000  # Mantissa
+            # Shift right by 142 - e (142 == bias + mantissa bits - _FRAC),
+            # rounding to nearest.
+            v = ((v >> (141 - e)) + 1) >> 1
+        if (b >> 31) & 1:
+            v = 0 - v
+        if v < tmin:
+            v = tmin
+        if v > tmax:
+            v = tmax
+        c = ((v - tmin) * fac + rnd) >> shift
+        if c > top:
+            c = top
+        if uselut:
+            c = int(lu[c])
+        if wide:
+            d16[i] = c
+        else:
+            d8[i] = c
+
+# Build a histogram of an array of floats. Decoding is as per _map. state[:512]
+# receives the counts. par: n, lo, hi (hi and lo have _FRAC fractional bits).
+@micropython.viper
+def _hist(src, state, par):
+    s = ptr32(src)
+    h = ptr32(state)
+    p = ptr32(par)
+    n = p[0]
+    lo = p[1]
+    hi = p[2]
+    for i in range(_BINS):
+        h[i] = 0
+    for i in range(n):
+        b = int(s[i])
+        e = (b >> 23) & 0xff
+        if e < 118:
+            v = 0
+        elif e > 141:
+            v = 0x10000000
+        else:
+            v = (b & 0x7fffff) | 0x800000
+            v = ((v >> (141 - e)) + 1) >> 1
+        if (b >> 31) & 1:
+            v = 0 - v
+        if v < lo:
+            v = lo
+        if v > hi:
+            v = hi
+        j = (v - lo + 32) >> 6  # Round to nearest bin, as does _map
+        if j >= _BINS:
+            j = _BINS - 1
+        h[j] = int(h[j]) + 1
+
+# Histogram equalisation. Convert the counts in state[:512] to a cumulative
+# distribution scaled to 0..ncolors and smooth it over time into state[512:].
+# Each bin is assigned the color at its center; alut receives color numbers
+# or, if par[1] is set, native colors from nlut. par: scale, native,
+# smoothing shift, first frame. scale is (ncolors << 16) // no. of pixels.
+@micropython.viper
+def _equalise(state, alut, nlut, par):
+    st = ptr32(state)
+    a = ptr16(alut)
+    nl = ptr16(nlut)
+    p = ptr32(par)
+    scale = p[0]
+    native = p[1]
+    k = p[2]
+    first = p[3]
+    cum = 0
+    for i in range(_BINS):
+        h = int(st[i])
+        target = (((cum << 1) + h) * scale) >> 1
+        cum += h
+        if first:
+            x = target
+        else:
+            x = int(st[i + _BINS])
+            x += (target - x) >> k
+        st[i + _BINS] = x
+        c = (x + 0x8000) >> 16
+        if native:
+            c = int(nl[c])
+        a[i] = c
+
+# Palettes. Each function takes a color number x in range 0..N and returns
+# r, g, b in range 0..255.
+
+# The original blue-green-red ramp with constant overall brightness.
+def _bgr(x, N):
+    return (max(int(255*(2*x/N - 1)), 0),
+            int(255*2*x/N) if x < N/2 else int(255*2*(1 - x/N)),
+            max(int(255*(1 - 2*x/N)), 0))
+
+# Linear interpolation between (r, g, b) points spaced evenly over 0..N.
+def _ramp(points, x, N):
+    pos = x * (len(points) - 1) / N
+    n = min(int(pos), len(points) - 2)
+    f = pos - n
+    return tuple(int(a + (b - a) * f) for a, b in zip(points[n], points[n + 1]))
+
+_IRONBOW = ((0, 0, 0), (32, 0, 140), (150, 0, 155), (220, 50, 60),
+            (250, 130, 0), (255, 210, 30), (255, 255, 255))
+
+def _ironbow(x, N):
+    return _ramp(_IRONBOW, x, N)
+
+def _grayscale(x, N):
+    v = int(255 * x / N)
+    return v, v, v
+
+# Gamma expanded gray: the scene stays dark with hot objects standing out
+# in white.
+def _white_hot(x, N):
+    v = int(255 * (x / N) ** 2.2)
+    return v, v, v
+
+_RAINBOW = ((128, 0, 255), (0, 0, 255), (0, 255, 255), (0, 255, 0),
+            (255, 255, 0), (255, 128, 0), (255, 0, 0))
+
+def _rainbow(x, N):
+    return _ramp(_RAINBOW, x, N)
+
+PALETTES = {'bgr' : _bgr, 'ironbow' : _ironbow, 'grayscale' : _grayscale,
+            'white_hot' : _white_hot, 'rainbow' : _rainbow}
+
+# Tables are generated once and shared by all Mapper instances.
+_colors = {}  # (palette, ncolors): (r, g, b) bytearrays
+_luts = {}  # (palette, ncolors, rgb): array of native colors
+
+def _get_colors(palette, ncolors):
+    key = (palette, ncolors)
+    if key not in _colors:
+        func = PALETTES[palette]  # KeyError if palette is unknown
+        rgbs = [func(x, ncolors) for x in range(ncolors + 1)]
+        _colors[key] = tuple(bytearray(c[i] for c in rgbs) for i in range(3))
+    return _colors[key]
+
+def _get_lut(palette, ncolors, rgb):
+    key = (palette, ncolors, rgb)
+    if key not in _luts:
+        r, g, b = _get_colors(palette, ncolors)
+        _luts[key] = array('H', (rgb(r[x], g[x], b[x]) for x in range(ncolors + 1)))
+    return _luts[key]
+
+# 4x4 Bayer matrix for ordered dithering: thresholds 0..15.
+_BAYER = (0, 8, 2, 10, 12, 4, 14, 6, 3, 11, 1, 9, 15, 7, 13, 5)
+
+# Return 16 concatenated tables of native colors, one for each position in
+# the Bayer matrix. steps are the r, g, b quantisation intervals of the
+# display: each channel is offset by up to half a step before conversion.
+def _get_dither(palette, ncolors, rgb, steps):
+    key = (palette, ncolors, rgb, steps)
+    if key not in _luts:
+        r, g, b = _get_colors(palette, ncolors)
+        lut = bytearray(16 * (ncolors + 1))
+        i = 0
+        for threshold in _BAYER:
+            f = (threshold + 0.5) / 16 - 0.5  # -0.5 < f < 0.5
+            dr, dg, db = (int(f * step) for step in steps)
+            for x in range(ncolors + 1):
+                lut[i] = rgb(min(max(r[x] + dr, 0), 255),
+                             min(max(g[x] + dg, 0), 255),
+                             min(max(b[x] + db, 0), 255))
+                i += 1
+        _luts[key] = lut
+    return _luts[key]
+
+# Return a list of (key, bytes) for cached tables: keys are (palette, ncolors)
+# for rgb tables, (palette, ncolors, rgb) for native color tables and
+# (palette, ncolors, rgb, steps) for dither tables.
+def cache_info():
+    res = [(k, sum(len(c) for c in v)) for k, v in _colors.items()]
+    res.extend((k, len(v) * (1 if isinstance(v, bytearray) else 2)) for k, v in _luts.items())
+    return res
+
 # Mapper class. Converts a temperature value to r, g, b colors. Colors are in
 # range 0..255. Temperature range may be specified.
+# If a display's rgb function is supplied, a lookup table of colors in the
+# display's native format is built. The native method then returns an int
+# ready for drawing without creating a tuple or calling rgb per pixel.
 class Mapper:
 
-    def __init__(self, tmin, tmax, ncolors=30):
-        self._ncolors = ncolors
-        N = ncolors
-        self._b = bytearray(max(int(255*(1 - 2*x/N)), 0) for x in range(N + 1))
-        self._g = bytearray(int(255*2*x/N) if x < N/2 else int(255*2*(1 - x/N)) for x in range(N + 1))
-        self._r = bytearray(max(int(255*(2*x/N - 1)), 0) for x in range(N + 1))
-        self.set_range(tmin, tmax)
+    def __init__(self, tmin, tmax, ncolors=30, rgb=None, palette='bgr'):
+        self._rgb = rgb
+        self._lut = None
+        self._wide = False  # Native colors need more than 8 bits
+        self._dev = None  # Indexed display
+        self._par = array('i', (0, 0, 0, 0, 0, 0, 0, _SHIFT))  # Args for _map
+        self._tmin = tmin
+        self._tmax = tmax
+        self._agc = None  # AGC state, allocated on demand
+        self._agc_on = False
+        self._smooth = 2
+        self.palette(palette, ncolors)  # Calls set_range
+
+    # Select a palette, optionally changing the number of colors. Tables are
+    # cached so switching back to a previously used palette is fast.
+    def palette(self, name=None, ncolors=None):
+        if name is not None:
+            if name not in PALETTES:
+                raise ValueError('Unknown palette {}'.format(name))
+            self._palette = name
+        if ncolors is not None:
+            if not 1 <= ncolors <= 255:
+                raise ValueError('ncolors must be in range 1..255.')
+            if self._dev is not None and ncolors >= len(self._lut):
+                raise ValueError('ncolors exceeds the reserved palette block.')
+            self._ncolors = ncolors
+            self._par[4] = ncolors
+        self._r, self._g, self._b = _get_colors(self._palette, self._ncolors)
+        if self._dev is not None:
+            self._dev.set_colors(self._base, self._r, self._g, self._b)
+        elif self._rgb is not None:
+            self._set_lut(_get_lut(self._palette, self._ncolors, self._rgb))
+        self.set_range(self._tmin, self._tmax)
+        self._first = True  # AGC history is invalid
+        return self._palette
+
+    # Build the table of native colors. The table is indexed by color number
+    # so it is independent of the temperature range.
+    def set_rgb(self, rgb):
+        self._rgb = rgb
+        self._dev = None
+        self._set_lut(_get_lut(self._palette, self._ncolors, rgb))
+
+    def _set_lut(self, lut):
+        self._lut = lut
+        self._wide = max(lut) > 0xff
+
+    # For displays with a palette (SSD1351 with indexed=True). A block of size
+    # palette entries is reserved and native color x is the index of entry x
+    # of the block. Selecting a palette rewrites the block, so palettes may be
+    # switched without using further entries; the image changes color without
+    # being redrawn. ncolors may not exceed size - 1. The default size allows
+    # 255 colors, leaving room for 15 other colors on the display.
+    def set_indexed(self, ssd, size=240):
+        if self._dev is ssd:
+            return  # Block is already reserved
+        if self._ncolors >= size:
+            raise ValueError('ncolors exceeds the reserved palette block.')
+        self._base = ssd.reserve(size)
+        self._rgb = None
+        self._dev = ssd
+        self._set_lut(array('H', range(self._base, self._base + size)))
+        self.palette()
 
+    # Ordered dither tables for 8 bit displays (RGB332 by default). Returns a
+    # bytearray of 16 native color tables each of ncolors + 1 entries. The
+    # table for screen position x, y starts at ((y & 3) * 4 + (x & 3)) *
+    # (ncolors + 1) and is indexed by color number. See render.py.
+    def dither_lut(self, steps=(32, 32, 64)):
+        if self._rgb is None:
+            raise ValueError('Dithering requires set_rgb.')
+        return _get_dither(self._palette, self._ncolors, self._rgb, tuple(steps))
+
+    # Automatic gain control. When enabled, map_into ignores the temperature
+    # range and uses histogram equalisation: each color is used by roughly the
+    # same number of pixels. The mapping is smoothed over frames to prevent
+    # flicker: smooth=0 disables this, larger values respond more slowly.
+    def agc(self, enable=None, smooth=None):
+        if enable is not None:
+            enable = bool(enable)
+            if enable and self._agc is None:
+                self._agc = array('i', (0 for _ in range(2 * _BINS)))
+                self._alut = array('H', (0 for _ in range(_BINS)))
+                # _map args: bins cover _AGC_LO.. in 0.25°C steps
+                self._apar = array('i', (0, _AGC_LO, _AGC_LO + 64 * _BINS - 1,
+                                         1 << 10, _BINS - 1, 0, 1, 16))
+                self._epar = array('i', (0 for _ in range(4)))
+            if enable and not self._agc_on:
+                self._first = True  # Discard stale history
+            self._agc_on = enable
+        if smooth is not None:
+            self._smooth = smooth
+        return self._agc_on
+
+    # The range may not exceed 16384°C: with _SHIFT fractional bits the
+    # factor then maps to within 1/4 color of index().
     def set_range(self, tmin, tmax):
-        if tmax <= tmin:
+        if tmax <= tmin or tmax - tmin >= 16384:
             raise ValueError('Invalid temperature range.')
         self._tmin = tmin
         self._tmax = tmax
         self._factor = self._ncolors/(tmax - tmin)
+        par = self._par
+        par[1] = round(tmin * (1 << _FRAC))
+        par[2] = max(round(tmax * (1 << _FRAC)), par[1] + 1)
+        par[3] = round((self._ncolors << _SHIFT) / (par[2] - par[1]))
+
+    # Native color table: lut[index(t)] == native(t)
+    @property
+    def lut(self):
+        return self._lut
+
+    def index(self, t):  # Celcius to color number 0..ncolors
+        t = max(min(t, self._tmax), self._tmin)
+        return round((t - self._tmin) * self._factor)
 
     def __call__(self, t):  # Celcius to color value
         # Constrain
@@ -29,3 +352,41 @@ class Mapper:
         t -= self._tmin
         t = round(t * self._factor)  # 0..ncolors
         return self._r[t], self._g[t], self._b[t]
+
+    def native(self, t):  # Celcius to display native color
+        t = max(min(t, self._tmax), self._tmin)
+        return self._lut[round((t - self._tmin) * self._factor)]
+
+    # Map an array('f') of temperatures to colors in one pass. dst may be a
+    # bytearray or an array('H') (needed for 16 bit native colors). By default
+    # native colors are produced, otherwise color numbers. Does not allocate.
+    # With AGC a histogram pass precedes the mapping pass.
+    def map_into(self, src, dst, native=True):
+        n = len(src)
+        if len(dst) < n:
+            raise ValueError('Destination is too small.')
+        if native and self._lut is None:
+            raise ValueError('Native colors require set_rgb.')
+        wide = not isinstance(dst, bytearray)
+        if native and self._wide and not wide:
+            raise ValueError('Native colors do not fit a bytearray.')
+        lut = self._lut if native else self._par  # Dummy if not native
+        if self._agc_on:
+            par = self._apar
+            par[0] = n
+            par[5] = wide
+            _hist(src, self._agc, par)
+            epar = self._epar
+            epar[0] = (self._ncolors << 16) // n
+            epar[1] = native
+            epar[2] = self._smooth
+            epar[3] = self._first
+            self._first = False
+            _equalise(self._agc, self._alut, lut, epar)
+            _map(src, dst, self._alut, par)
+        else:
+            par = self._par
+            par[0] = n
+            par[5] = wide
+            par[6] = native
+            _map(src, dst, lut, par)
@@ -5,6 +5,9 @@
 # double-click events
 # Tested on Pyboard but should run on other microcontroller platforms
 # running MicroPython and uasyncio.
+# Where uasyncio provides ThreadSafeFlag (V3) and pins support interrupts,
+# switches are event driven: there is no CPU use while they are idle.
+# Under uasyncio V3 all Delay_ms instances share a single timer task.
 
 # The MIT License (MIT)
 #
@@ -30,6 +33,12 @@
 
 import uasyncio as asyncio
 import utime as time
+try:
+    from machine import Pin
+    _IRQ = hasattr(asyncio, 'ThreadSafeFlag')
+except ImportError:
+    _IRQ = False
+_TIMERS = hasattr(asyncio, 'Event') and hasattr(asyncio, 'wait_for_ms')
 # Remove dependency on asyn to save RAM:
 # launch: run a callback or initiate a coroutine depending on which is passed.
 async def _g():
@@ -46,15 +55,79 @@ def launch(func, tup_args):
         loop.create_task(res)
 
 
+# Timer service shared by Delay_ms instances. Running delays are held in a
+# list in order of the time at which each is due to be checked. One task
+# sleeps until the first is due or until an Event signals a new first entry.
+# Retriggering to a later time only updates the delay's end time: when its
+# check time arrives it is queued again. There is no CPU use while no delay is
+# running.
+class _Timers:
+    def __init__(self):
+        self._q = []
+        self._evt = asyncio.Event()
+        loop = asyncio.get_event_loop()
+        loop.create_task(self._run())  # Thread runs forever
+
+    # Queue a delay to be checked at its end time.
+    def add(self, d):
+        q = self._q
+        t = d.tstop
+        d._tq = t
+        i = 0
+        while i < len(q) and time.ticks_diff(q[i]._tq, t) <= 0:
+            i += 1
+        q.insert(i, d)
+        if i == 0:
+            self._evt.set()  # Sleep time has changed
+
+    def remove(self, d):
+        self._q.remove(d)
+        d._tq = None
+
+    async def _run(self):
+        q = self._q
+        evt = self._evt
+        while True:
+            if q:
+                dt = time.ticks_diff(q[0]._tq, time.ticks_ms())
+                if dt > 0:
+                    try:
+                        await asyncio.wait_for_ms(evt.wait(), dt)
+                    except asyncio.TimeoutError:
+                        pass
+            else:
+                await evt.wait()
+            evt.clear()
+            now = time.ticks_ms()
+            while q and time.ticks_diff(q[0]._tq, now) <= 0:
+                d = q.pop(0)
+                d._tq = None
+                if d.tstop is None:  # stop() was called
+                    continue
+                if time.ticks_diff(d.tstop, now) > 0:  # Retriggered
+                    self.add(d)
+                else:  # Timed out: execute callback
+                    d.tstop = None
+                    if d.func is not None:
+                        launch(d.func, d.args)
+
+_timers = None
+
+# With the timer service can_alloc has no effect: nothing is allocated.
 class Delay_ms(object):
     def __init__(self, func=None, args=(), can_alloc=True, duration=1000):
+        global _timers
         self.func = func
         self.args = args
         self.can_alloc = can_alloc
         self.duration = duration  # Default duration
         self.tstop = None  # Not running
+        self._tq = None  # Time when queued for checking by timer service
         self.loop = asyncio.get_event_loop()
-        if not can_alloc:
+        if _TIMERS:
+            if _timers is None:
+                _timers = _Timers()
+        elif not can_alloc:
             self.loop.create_task(self._run())
 
     async def _run(self):
@@ -70,6 +143,14 @@ class Delay_ms(object):
     def trigger(self, duration=0):  # Update end time
         if duration <= 0:
             duration = self.duration
+        if _TIMERS:
+            self.tstop = time.ticks_add(time.ticks_ms(), duration)
+            if self._tq is None:
+                _timers.add(self)
+            elif time.ticks_diff(self.tstop, self._tq) < 0:  # Now due earlier
+                _timers.remove(self)
+                _timers.add(self)
+            return
         if self.can_alloc and self.tstop is None:  # No killer task is running
             self.tstop = time.ticks_add(time.ticks_ms(), duration)
             # Start a task which stops the delay after its period has elapsed
@@ -92,6 +173,48 @@ class Delay_ms(object):
             launch(self.func, self.args)  # Timed out: execute callback
         self.tstop = None  # Not running
 
+# Pin change interrupts set a flag which wakes a single task shared by all
+# Switch and Pushbutton instances. The task checks switches which have changed
+# and polls them until they settle, then waits on the flag again.
+class _Debouncer:
+    def __init__(self):
+        self.flag = asyncio.ThreadSafeFlag()
+        self._objs = []
+        loop = asyncio.get_event_loop()
+        loop.create_task(self._run())  # Thread runs forever
+
+    def add(self, obj):
+        self._objs.append(obj)
+        obj.pin.irq(obj._isr, Pin.IRQ_RISING | Pin.IRQ_FALLING)
+
+    async def _run(self):
+        objs = self._objs
+        while True:
+            await self.flag.wait()
+            while True:
+                ms = 0
+                for obj in objs:
+                    if obj._changed:
+                        obj._changed = False  # Before reading pin
+                        obj._check()
+                        ms = max(ms, obj.debounce_ms)
+                if not ms:
+                    break  # All have settled
+                # Ignore further state changes until switches have settled
+                await asyncio.sleep_ms(ms)
+
+_debouncer = None
+
+# Use the shared debouncer if possible. Return False if the caller must poll.
+def _register(obj):
+    global _debouncer
+    if not (_IRQ and hasattr(obj.pin, 'irq')):
+        return False
+    if _debouncer is None:
+        _debouncer = _Debouncer()
+    _debouncer.add(obj)
+    return True
+
 class Switch(object):
     debounce_ms = 50
     def __init__(self, pin):
@@ -99,8 +222,14 @@ class Switch(object):
         self._open_func = False
         self._close_func = False
         self.switchstate = self.pin.value()  # Get initial state
-        loop = asyncio.get_event_loop()
-        loop.create_task(self.switchcheck())  # Thread runs forever
+        self._changed = False  # Set by interrupt
+        if not _register(self):
+            loop = asyncio.get_event_loop()
+            loop.create_task(self.switchcheck())  # Thread runs forever
+
+    def _isr(self, _):
+        self._changed = True
+        _debouncer.flag.set()
 
     def open_func(self, func, args=()):
         self._open_func = func
@@ -114,16 +243,19 @@ class Switch(object):
     def __call__(self):
         return self.switchstate
 
+    def _check(self):
+        state = self.pin.value()
+        if state != self.switchstate:
+            # State has changed: act on it now.
+            self.switchstate = state
+            if state == 0 and self._close_func:
+                launch(self._close_func, self._close_args)
+            elif state == 1 and self._open_func:
+                launch(self._open_func, self._open_args)
+
     async def switchcheck(self):
         while True:
-            state = self.pin.value()
-            if state != self.switchstate:
-                # State has changed: act on it now.
-                self.switchstate = state
-                if state == 0 and self._close_func:
-                    launch(self._close_func, self._close_args)
-                elif state == 1 and self._open_func:
-                    launch(self._open_func, self._open_args)
+            self._check()
             # Ignore further state changes until switch has settled
             await asyncio.sleep_ms(Switch.debounce_ms)
 
@@ -144,8 +276,14 @@ class Pushbutton(object):
         self._dd = False  # Ditto for doubleclick
         self.sense = pin.value()  # Convert from electrical to logical value
         self.state = self.rawstate()  # Initial state
-        loop = asyncio.get_event_loop()
-        loop.create_task(self.buttoncheck())  # Thread runs forever
+        self._changed = False  # Set by interrupt
+        if not _register(self):
+            loop = asyncio.get_event_loop()
+            loop.create_task(self.buttoncheck())  # Thread runs forever
+
+    def _isr(self, _):
+        self._changed = True
+        _debouncer.flag.set()
 
     def press_func(self, func, args=()):
         self._tf = func
@@ -177,43 +315,46 @@ class Pushbutton(object):
             if not self._ld or (self._ld and not self._ld()):
                 launch(self._ff, self._fa)
 
-    async def buttoncheck(self):
-        if self._lf:  # Instantiate timers if funcs exist
+    def _check(self):
+        if self._lf and not self._ld:  # Instantiate timers if funcs exist
             self._ld = Delay_ms(self._lf, self._la)
-        if self._df:
+        if self._df and not self._dd:
             self._dd = Delay_ms(self._ddto)
+        state = self.rawstate()
+        # State has changed: act on it now.
+        if state != self.state:
+            self.state = state
+            if state:  # Button pressed: launch pressed func
+                if self._tf:
+                    launch(self._tf, self._ta)
+                if self._lf:  # There's a long func: start long press delay
+                    self._ld.trigger(Pushbutton.long_press_ms)
+                if self._df:
+                    if self._dd():  # Second click: timer running
+                        self._dd.stop()
+                        self._dblpend = False
+                        self._dblran = True  # Prevent suppressed launch on release
+                        launch(self._df, self._da)
+                    else:
+                        # First click: start doubleclick timer
+                        self._dd.trigger(Pushbutton.double_click_ms)
+                        self._dblpend = True  # Prevent suppressed launch on release
+            else:  # Button release. Is there a release func?
+                if self._ff:
+                    if self._supp:
+                        d = self._ld 
+                        # If long delay exists, is running and doubleclick status is OK
+                        if not self._dblpend and not self._dblran:
+                            if (d and d()) or not d:
+                                launch(self._ff, self._fa)
+                    else:
+                        launch(self._ff, self._fa)
+                if self._ld:
+                    self._ld.stop()  # Avoid interpreting a second click as a long push
+                self._dblran = False
+
+    async def buttoncheck(self):
         while True:
-            state = self.rawstate()
-            # State has changed: act on it now.
-            if state != self.state:
-                self.state = state
-                if state:  # Button pressed: launch pressed func
-                    if self._tf:
-                        launch(self._tf, self._ta)
-                    if self._lf:  # There's a long func: start long press delay
-                        self._ld.trigger(Pushbutton.long_press_ms)
-                    if self._df:
-                        if self._dd():  # Second click: timer running
-                            self._dd.stop()
-                            self._dblpend = False
-                            self._dblran = True  # Prevent suppressed launch on release
-                            launch(self._df, self._da)
-                        else:
-                            # First click: start doubleclick timer
-                            self._dd.trigger(Pushbutton.double_click_ms)
-                            self._dblpend = True  # Prevent suppressed launch on release
-                else:  # Button release. Is there a release func?
-                    if self._ff:
-                        if self._supp:
-                            d = self._ld 
-                            # If long delay exists, is running and doubleclick status is OK
-                            if not self._dblpend and not self._dblran:
-                                if (d and d()) or not d:
-                                    launch(self._ff, self._fa)
-                        else:
-                            launch(self._ff, self._fa)
-                    if self._ld:
-                        self._ld.stop()  # Avoid interpreting a second click as a long push
-                    self._dblran = False
+            self._check()
             # Ignore state changes until switch has settled
             await asyncio.sleep_ms(Pushbutton.debounce_ms)
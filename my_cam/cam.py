@@ -9,26 +9,80 @@ from utime import ticks_ms, ticks_diff
 import uasyncio as asyncio
 from micropython import const, mem_info
 import gc
+from array import array
 
-from primitives.switch import Switch
-from primitives.delay_ms import Delay_ms
+from aswitch import Switch, Delay_ms  # Interrupt driven switches
 from ssd1351_16bit import SSD1351 as SSD  # STM Asm version
-from writer import CWriter
+from writer import Writer, CWriter, FontIndex
+from textfield import TextField
 import courier17 as font  # Main text
 import arial10  # Small text
 from mapper import Mapper  # Maps temperature to rgb color
+import render  # Fast image drawing
 from amg88xx import AMG88XX
-from interpolate_a import Interpolator  # STM assembler version
+from interpolator import Interpolator  # Fastest available backend
+from pipeline import Pipeline
+from profiler import Profiler
 
 freq(216_000_000)  # In old version improved update rate 750ms -> 488ms
 
 eliza = lambda *_ : None
 
+_PERIOD = const(100)  # Sensor frame period (ms)
+
+# Profiler sections
+_I2C = const(0)
+_DECODE = const(1)
+_INTERP = const(2)
+_MAP = const(3)
+_DRAW = const(4)
+_TEXT = const(5)
+_SHOW = const(6)
+_GC = const(7)
+_SECTIONS = ('I2C read', 'decode', 'interp', 'map', 'draw', 'text', 'show', 'GC')
+
+# A sensor frame: queued by the acquire stage.
+class Frame:
+    def __init__(self):
+        self._data = array('h', (0 for _ in range(64)))
+        self.chip = 0  # Chip temperature
+
+    def load(self, pir):
+        data = self._data
+        for row in range(8):
+            for col in range(8):
+                data[row * 8 + col] = pir[row, col]
+
+    def __getitem__(self, index):
+        row, col = index
+        return self._data[row * 8 + col]
+
+# Presents the frame being processed to the interpolator as a sensor.
+class Source:
+    def __init__(self):
+        self.frame = None
+
+    def refresh(self, _=None):
+        pass  # Data was read by the acquire stage
+
+    def __getitem__(self, index):
+        return self.frame[index]
+
+# A processed image: queued by the process stage.
+class Image:
+    def __init__(self):
+        self.colors = bytearray(1024)  # Palette indices (display is indexed)
+        self.max_t = 0
+        self.min_t = 0
+        self.avg = 0
+        self.chip = 0
+
 # Possible modes. Note there is no point in having a _HOLD mode as the text
 # fields are not updated so it would never show.
 _NORM = const(0)
 _AUTO = const(1)
 _HOG = const(2)
+_EQ = const(3)  # Auto range with histogram equalisation
 
 class Cam:
 
@@ -38,6 +92,7 @@ class Cam:
         self.tmax = 30  # Initial temperature range
         self.tmin = 15
         self.mode = _NORM
+        self._prev_mode = _NORM  # Mode before the current switch press
         # Enable initial update
         self.rf_disp = True
         self.rf_txt = True
@@ -63,9 +118,12 @@ class Cam:
         # dominated by interpolation time
         spi = SPI(2, baudrate=13_500_000)
         verbose and print('SPI:', spi)
-        ssd = SSD(spi, pcs, pdc, prst)  # Create a display instance
+        # Double buffered: the next frame is computed while this one is sent.
+        # Indexed color halves the RAM used by the two framebufs.
+        ssd = SSD(spi, pcs, pdc, prst, double=True, indexed=True)
         ssd.fill(0)
         ssd.show()
+        self.mapper.set_indexed(ssd)  # Native colors are palette indices
 
         self.avg = 0.0
         # Instantiate PIR temperature sensor
@@ -74,11 +132,15 @@ class Cam:
         pir.ma_mode(True)  # Moving average mode
 
         # Run the camera
+        self.pipeline = Pipeline()
+        self.prof = Profiler(_SECTIONS)
         asyncio.create_task(self.run(pir, ssd))
+        verbose and asyncio.create_task(self.report())
 
     # A switch was pressed. Change temperature range.
     def press(self, func, arg):
         self.timer.trigger()
+        self._prev_mode = self.mode  # For a long press
         self.mode = _NORM
         if self.mode == _AUTO:  # Short press clears auto range, leaves range unchanged
             self.rf_disp = True
@@ -109,18 +171,19 @@ class Cam:
             self.mode = _HOG
             self.tmin = self.avg
             self.tmax = self.avg + 5
-        else:  # Auto range
-            self.mode = _AUTO
+        else:  # Auto range. A further long press enables equalisation.
+            self.mode = _EQ if self._prev_mode == _AUTO else _AUTO
         self.rf_disp = True
         self.rf_txt = True  # Show changed range
 
-    # Draw color scale at right of display
+    # Draw color scale at right of display. In _EQ mode colors are not linear
+    # in temperature: the mode field labels the scale as equalised.
     def draw_scale(self, ssd):
         col = 75
         val = self.tmax
         dt = (self.tmax - self.tmin) / 31
         for row in range(32):
-            ssd.rect(col, row * 2, 15, 2, ssd.rgb(*self.mapper(val)))
+            ssd.rect(col, row * 2, 15, 2, self.mapper.native(val))
             val -= dt
 
     # Refreshing text is slow so do it periodically to maximise mean image framerate
@@ -139,21 +202,123 @@ class Cam:
         yellow = ssd.rgb(255, 255, 0)
         green = ssd.rgb(0, 255, 0)
 
-        # Instantiate CWriters
-        wri_l = CWriter(ssd, font, green, black, self.verbose)  # Large font.
-        wri_s = CWriter(ssd, arial10, white, black, self.verbose)  # Small text
+        # Instantiate CWriters. Labels and recent values are drawn from the
+        # rendered string cache.
+        Writer.set_cache(2048)
+        # FontIndex avoids decoding the font index for every character.
+        wri_l = CWriter(ssd, FontIndex(font), green, black, self.verbose)  # Large font.
+        wri_s = CWriter(ssd, FontIndex(arial10), white, black, self.verbose)  # Small text
+
+        # Draw labels once. Values are TextFields which redraw only changed
+        # characters and return the area to send to the display.
+        wri_l.set_textpos(ssd, 66, 0)
+        wri_l.printstring('Max:\nMin:\nAvg:')
+        col = wri_l.stringlen('Max:')
+        fmt = '{:+4d}C'
+        f_max = TextField(wri_l, 66, col, 128 - col, fmt)
+        f_min = TextField(wri_l, 66 + font.height(), col, 128 - col, fmt)
+        f_avg = TextField(wri_l, 66 + 2 * font.height(), col, 128 - col, fmt)
+        row = 128 - arial10.height()
+        wri_s.set_textpos(ssd, row, 64)
+        wri_s.setcolor(yellow, black)
+        wri_s.printstring('Chip:')
+        col = 64 + wri_s.stringlen('Chip:')
+        f_chip = TextField(wri_s, row, col, 128 - col, '{:5.1f}C')
+        f_tmax = TextField(wri_s, 0, 90, 38, '{:4d}C')
+        f_mode = TextField(wri_s, 28, 95, 33)
+        f_tmin = TextField(wri_s, 64 - arial10.height(), 90, 38, '{:4d}C')
+
+        def mark(r):  # Send a changed field at the next refresh
+            if r is not None:
+                ssd.dirty(*r)
 
-        # Instantiate interpolator and draw the scale
-        interp = Interpolator(pir)
         self.draw_scale(ssd)
+        ssd.dirty(64, 0, 64, 64)  # Scale and range
+        ssd.dirty(0, 64, 128, 64)  # Labels
+
+        # Stages communicate via queues of preallocated slots. If a stage
+        # falls behind the oldest queued frame is dropped so the display
+        # shows the latest data.
+        pl = self.pipeline
+        frames = pl.queue('frames', Frame)
+        images = pl.queue('images', Image)
+        pl.stage('acquire', self.acquire, pir, frames)
+        pl.stage('process', self.process, frames, images)
+        stage = pl.add('render')  # This task
+        prof = self.prof
+
+        # Render stage
+        while True:
+            img = await images.get()
+            prof.start(_DRAW)
+            render.blit(ssd, img.colors, 32, 32, 2, 0, 0)
+            prof.stop(_DRAW)
+            if self.rf_disp:
+                if self.rf_txt:
+                    prof.start(_TEXT)
+                    mark(f_max.value(int(img.max_t)))
+                    mark(f_min.value(int(img.min_t)))
+                    mark(f_avg.value(img.avg))
+                    wri_s.setcolor(yellow, black)
+                    mark(f_chip.value(img.chip))
+                    wri_s.setcolor(red, black)
+                    mark(f_tmax.value(self.tmax))
+                    wri_s.setcolor(green, black)
+                    mark(f_mode.value(('Norm', 'Auto', 'Hog', 'Eq')[self.mode]))
+                    wri_s.setcolor(blue, black)
+                    mark(f_tmin.value(self.tmin))
+                    self.rf_txt = False
+                    prof.stop(_TEXT)
+                ssd.dirty(0, 0, 64, 64)  # Image
+                # Time includes other tasks which run during the transfer
+                prof.start(_SHOW)
+                await ssd.show_async()  # Let other tasks run during transfer
+                prof.stop(_SHOW)
+            images.release(img)
+            stage.done()
+            prof.start(_GC)
+            gc.collect()
+            prof.stop(_GC)
+#            self.verbose and mem_info()
 
+    # Acquire stage: read the sensor at its frame rate.
+    async def acquire(self, stage, pir, frames):
+        prof = self.prof
         while True:
-            t = ticks_ms()  # For verbose timing
-            self.mapper.set_range(self.tmin, self.tmax)
-            interp.refresh()  # Acquire data
+            t = ticks_ms()
+            frame = frames.slot()
+            prof.start(_I2C)
+            pir.refresh()
+            frame.chip = pir.temperature()
+            prof.stop(_I2C)
+            prof.start(_DECODE)
+            frame.load(pir)
+            prof.stop(_DECODE)
+            frames.put(frame)
+            stage.done()
+            await asyncio.sleep_ms(max(_PERIOD - ticks_diff(ticks_ms(), t), 0))
+
+    # Process stage: interpolate and map temperatures to colors.
+    async def process(self, stage, frames, images):
+        src = Source()
+        interp = Interpolator(src)
+        temps = array('f', (0 for _ in range(1024)))  # Interpolated frame
+        prof = self.prof
+        while True:
+            frame = await frames.get()
+            prof.start(_INTERP)
+            src.frame = frame
+            interp.refresh()
+            img = images.slot()
+            img.chip = frame.chip
+            frames.release(frame)
+            mapper = self.mapper
+            mapper.set_range(self.tmin, self.tmax)
+            mapper.agc(self.mode == _EQ)  # Histogram equalisation
             max_t = -1000
             min_t = 1000
             sum_t = 0
+            i = 0
             for row in range(32):
                 for col in range(32):
                     # Transpose, reflect and invert
@@ -161,40 +326,31 @@ class Cam:
                     max_t = max(max_t, val)
                     min_t = min(min_t, val)
                     sum_t += val
-                    ssd.rect(col * 2, row * 2, 2, 2, ssd.rgb(*self.mapper(val)))
+                    temps[i] = val
+                    i += 1
+                prof.stop(_INTERP, True)  # Exclude time in other tasks
                 await asyncio.sleep(0)
-            self.avg = round(sum_t / 1024)
-            if self.mode == _AUTO:
+                prof.start(_INTERP)
+            prof.stop(_INTERP)
+            prof.start(_MAP)
+            mapper.map_into(temps, img.colors)
+            prof.stop(_MAP)
+            img.max_t = max_t
+            img.min_t = min_t
+            img.avg = round(sum_t / 1024)
+            self.avg = img.avg
+            if self.mode == _AUTO or self.mode == _EQ:
                 self.tmin = round(min_t)
                 self.tmax = round(max_t)
-            if self.rf_disp:
-                if self.rf_txt:
-                    wri_l.set_textpos(ssd, 66, 0)
-                    wri_l.printstring('Max:{:+4d}C\n'.format(int(max_t)))
-                    wri_l.printstring('Min:{:+4d}C\n'.format(int(min_t)))
-                    wri_l.printstring('Avg:{:+4d}C'.format(self.avg))
-                    wri_s.set_textpos(ssd, 128 - arial10.height(), 64)
-                    wri_s.setcolor(yellow, black)
-                    wri_s.printstring('Chip:{:5.1f}C'.format(pir.temperature()))
-                    wri_s.set_textpos(ssd, 0, 90)
-                    wri_s.setcolor(red, black)
-                    wri_s.printstring('{:4d}C '.format(self.tmax))
-                    wri_s.set_textpos(ssd, 28, 95)
-                    wri_s.setcolor(green, black)
-                    if self.mode == _HOG:
-                        wri_s.printstring('Hog  ')
-                    elif self.mode == _NORM:
-                        wri_s.printstring('Norm  ')
-                    else:
-                        wri_s.printstring('Auto  ')
-                    wri_s.set_textpos(ssd, 64 - arial10.height(), 90)
-                    wri_s.setcolor(blue, black)
-                    wri_s.printstring('{:4d}C '.format(self.tmin))
-                    self.rf_txt = False
-                ssd.show()
-            self.verbose and print(ticks_diff(ticks_ms(), t))
-            gc.collect()
-#            self.verbose and mem_info()
+            images.put(img)
+            stage.done()
+
+    # Print stage throughput, dropped frames and section times.
+    async def report(self):
+        while True:
+            await asyncio.sleep_ms(5000)
+            self.pipeline.report()
+            self.prof.report()
 
 # stack: 1276 out of 15360
 # GC: total: 196672, used: 52128, free: 144544
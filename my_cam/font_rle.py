@@ -0,0 +1,176 @@
+# font_rle.py Convert a font module produced by font_to_py.py to a module with
+# run length encoded glyphs. Runs under CPython.
+
+# Released under the MIT licence.
+# Copyright (c) Peter Hinch 2019
+
+# Usage:
+# python3 font_rle.py courier17.py courier17_rle.py
+# The output module has the same interface as the input, with get_ch returning
+# a decompressed copy of the glyph. It also provides compressed(),
+# get_width(ch) and unpack(ch, buf) which writer.py uses to decompress into
+# its glyph cache without allocating for each character.
+
+# Encoding: the pixels of a glyph are taken in row order, excluding the
+# padding bits at the end of each row. They are coded as alternating runs of
+# background and foreground pixels starting with background. Each run length is
+# a nibble, high nibble first. 15 means 15 pixels with the run continuing in
+# the next nibble. Glyphs which would not be reduced in size are stored
+# uncompressed, flagged by bit 7 of their width.
+
+import sys
+import os
+import importlib.util
+
+def _pixels(glyph, width, height, reverse):
+    gbytes = (width + 7) // 8
+    for row in range(height):
+        for col in range(width):
+            byte = glyph[row * gbytes + col // 8]
+            yield (byte >> (col & 7 if reverse else 7 - (col & 7))) & 1
+
+def encode(glyph, width, height, reverse=False):
+    nibbles = []
+    color = 0
+    run = 0
+    for pixel in _pixels(glyph, width, height, reverse):
+        if pixel != color:
+            nibbles.append(run)
+            color = pixel
+            run = 0
+        run += 1
+        if run == 15:
+            nibbles.append(15)  # Run continues
+            run = 0
+    nibbles.append(run)
+    if len(nibbles) & 1:
+        nibbles.append(0)  # Zero length run: no effect
+    return bytes((nibbles[i] << 4) | nibbles[i + 1] for i in range(0, len(nibbles), 2))
+
+def decode(data, width, height, reverse=False):
+    gbytes = (width + 7) // 8
+    buf = bytearray(gbytes * height)
+    p = 0
+    one = False
+    for b in data:
+        for run in (b >> 4, b & 15):
+            if one:
+                for q in range(p, p + run):
+                    r, c = divmod(q, width)
+                    buf[r * gbytes + (c >> 3)] |= (1 << (c & 7)) if reverse else (0x80 >> (c & 7))
+            p += run
+            if run != 15:
+                one = not one
+    return buf
+
+def _bytes(name, data):
+    lines = ['{} =\\'.format(name)]
+    for i in range(0, len(data), 16):
+        lines.append("b'" + ''.join('\\x{:02x}'.format(b) for b in data[i : i + 16]) + "'\\")
+    lines.append("b''")
+    return '\n'.join(lines)
+
+_CODE = '''
+_mvfont = memoryview(_font)
+
+def _idx(ch):
+    i = ord(ch) - {min_ch}
+    return i if 0 <= i < {n} else {n}  # Last glyph is the default
+
+def get_width(ch):
+    return _widths[_idx(ch)] & 0x7f
+
+# Decompress the glyph for ch into buf. Return height, width.
+def unpack(ch, buf):
+    i = _idx(ch)
+    src = int.from_bytes(_index[2 * i : 2 * i + 2], 'little')
+    end = int.from_bytes(_index[2 * i + 2 : 2 * i + 4], 'little')
+    width = _widths[i] & 0x7f
+    gbytes = (width + 7) >> 3
+    n = gbytes * {height}
+    if _widths[i] & 0x80:  # Stored uncompressed
+        buf[: n] = _mvfont[src : end]
+        return {height}, width
+    for j in range(n):
+        buf[j] = 0
+    p = 0  # Pixel number
+    one = False
+    for j in range(src, end):
+        b = _font[j]
+        for shift in (4, 0):
+            run = (b >> shift) & 15
+            if one:
+                for q in range(p, p + run):
+                    r, c = divmod(q, width)
+                    buf[r * gbytes + (c >> 3)] |= {mask}
+            p += run
+            if run != 15:
+                one = not one
+    return {height}, width
+
+def get_ch(ch):
+    width = get_width(ch)
+    buf = bytearray(((width + 7) >> 3) * {height})
+    unpack(ch, buf)
+    return memoryview(buf), {height}, width
+'''
+
+# Return the source of a compressed module, the size of the input glyph data
+# and of the output font data.
+def convert(infile):
+    spec = importlib.util.spec_from_file_location('font', infile)
+    font = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(font)
+    if not font.hmap():
+        raise ValueError('Font must be horizontally mapped.')
+    min_ch = font.min_ch() if hasattr(font, 'min_ch') else 32
+    max_ch = font.max_ch() if hasattr(font, 'max_ch') else 126
+    height = font.height()
+    reverse = font.reverse()
+    # Glyphs for min_ch..max_ch followed by the default for other chars
+    chars = [chr(c) for c in range(min_ch, max_ch + 1)] + [chr(0)]
+    data = bytearray()
+    index = bytearray()
+    widths = bytearray()
+    raw = 0
+    for ch in chars:
+        glyph, _, width = font.get_ch(ch)
+        glyph = bytes(glyph)
+        if width > 127:
+            raise ValueError('Glyph is too wide.')
+        coded = encode(glyph, width, height, reverse)
+        assert decode(coded, width, height, reverse) == glyph
+        index.extend(len(data).to_bytes(2, 'little'))
+        if len(coded) < len(glyph):
+            data.extend(coded)
+            widths.append(width)
+        else:
+            data.extend(glyph)
+            widths.append(width | 0x80)
+        raw += len(glyph)
+    index.extend(len(data).to_bytes(2, 'little'))
+    if len(data) > 0xffff:
+        raise ValueError('Font is too large.')
+    src = ['# Code generated by font_rle.py from {}.'.format(os.path.basename(infile)),
+           '# Glyphs are run length encoded.',
+           "version = '0.1'", '']
+    for name, value in (('height', height), ('max_width', font.max_width()),
+                        ('hmap', True), ('reverse', reverse),
+                        ('monospaced', font.monospaced()), ('min_ch', min_ch),
+                        ('max_ch', max_ch), ('compressed', True)):
+        src.append('def {}():\n    return {}\n'.format(name, value))
+    src.append(_bytes('_font', data) + '\n')
+    src.append(_bytes('_index', index) + '\n')
+    src.append(_bytes('_widths', widths))
+    mask = '1 << (c & 7)' if reverse else '0x80 >> (c & 7)'
+    src.append(_CODE.format(min_ch=min_ch, n=len(chars) - 1, height=height, mask=mask))
+    return '\n'.join(src), raw, len(data) + len(index) + len(widths)
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print('Usage: python3 font_rle.py infile.py outfile.py')
+        sys.exit(1)
+    src, raw, packed = convert(sys.argv[1])
+    with open(sys.argv[2], 'w') as f:
+        f.write(src)
+    print('Glyph data {} bytes, compressed font data {} bytes.'.format(raw, packed))
@@ -0,0 +1,119 @@
+# pipeline.py Staged processing with bounded queues for uasyncio V3
+
+# Released under the MIT licence.
+# Copyright (c) Peter Hinch 2019
+
+# Stages are tasks connected by queues. Each queue owns a fixed set of
+# preallocated slots (e.g. buffers) which are passed by reference: no data
+# is copied and nothing is allocated per frame. If a consumer falls behind,
+# put() discards the oldest queued slot so that the consumer always receives
+# the newest data rather than a backlog.
+# Usage:
+# pl = Pipeline()
+# q = pl.queue('frames', lambda : bytearray(128))
+# async def producer(stage):
+#     while True:
+#         buf = q.slot()  # Never blocks
+#         ...  # Fill buf
+#         q.put(buf)
+#         stage.done()
+# async def consumer(stage):
+#     while True:
+#         buf = await q.get()
+#         ...  # Use buf
+#         q.release(buf)
+#         stage.done()
+# pl.stage('acquire', producer)
+# pl.stage('display', consumer)
+
+import uasyncio as asyncio
+from utime import ticks_ms, ticks_diff
+
+# A queue with one producer and one consumer. Each holds at most one slot at a
+# time so size + 2 slots are sufficient.
+class Queue:
+    def __init__(self, name, factory, size=1):
+        self.name = name
+        self._size = size
+        self._free = [factory() for _ in range(size + 2)]
+        self._full = []  # Oldest first
+        self._evt = asyncio.Event()
+        self.puts = 0
+        self.dropped = 0
+
+    # Return a free slot for the producer to fill.
+    def slot(self):
+        return self._free.pop()
+
+    def put(self, slot):
+        if len(self._full) >= self._size:  # Consumer is behind: drop oldest
+            self._free.append(self._full.pop(0))
+            self.dropped += 1
+        self._full.append(slot)
+        self.puts += 1
+        self._evt.set()
+
+    # Return the oldest slot, waiting if the queue is empty.
+    async def get(self):
+        while not self._full:
+            self._evt.clear()
+            await self._evt.wait()
+        return self._full.pop(0)
+
+    # Return a slot obtained with get() to the queue.
+    def release(self, slot):
+        self._free.append(slot)
+
+    def __len__(self):
+        return len(self._full)
+
+class Stage:
+    def __init__(self, name):
+        self.name = name
+        self.count = 0  # Items processed
+        self._last = 0  # Count at last report
+
+    # Call after processing each item.
+    def done(self):
+        self.count += 1
+
+class Pipeline:
+    def __init__(self):
+        self._stages = []
+        self._queues = []
+        self._t = ticks_ms()
+
+    def queue(self, name, factory, size=1):
+        q = Queue(name, factory, size)
+        self._queues.append(q)
+        return q
+
+    # Register a stage which runs in an existing task.
+    def add(self, name):
+        s = Stage(name)
+        self._stages.append(s)
+        return s
+
+    # Start a stage. coro is a coroutine function which is passed the Stage
+    # followed by any args.
+    def stage(self, name, coro, *args):
+        s = self.add(name)
+        asyncio.create_task(coro(s, *args))
+        return s
+
+    # Return a list of (name, items per second) for each stage over the time
+    # since the last call, and of (name, puts, dropped) for each queue.
+    def stats(self):
+        t = ticks_ms()
+        dt = max(ticks_diff(t, self._t), 1)
+        self._t = t
+        rates = []
+        for s in self._stages:
+            rates.append((s.name, (s.count - s._last) * 1000 / dt))
+            s._last = s.count
+        return rates, [(q.name, q.puts, q.dropped) for q in self._queues]
+
+    def report(self):
+        rates, queues = self.stats()
+        print(' '.join('{}: {:4.1f}/s'.format(*r) for r in rates))
+        print(' '.join('{}: {} in {} dropped'.format(*q) for q in queues))
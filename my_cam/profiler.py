@@ -0,0 +1,103 @@
+# profiler.py Lightweight per-section timing and allocation profiler.
+
+# Released under the MIT licence.
+# Copyright (c) Peter Hinch 2019
+
+# Each named section keeps the durations of its most recent samples in a
+# preallocated ring buffer, along with the change in gc.mem_alloc() over the
+# section. Recording a sample does not allocate. report() computes min, mean,
+# 95th percentile and max: this allocates so should only be called on request.
+# Usage:
+# prof = Profiler(('read', 'draw'))
+# prof.start(0)
+# ... read
+# prof.stop(0)
+# prof.report()
+# A section which contains an await may be timed in parts so that time spent
+# in other tasks is excluded. Call stop(n, True) before each await and start(n)
+# after it: the sample is recorded at the final stop(n). Its allocation delta
+# may include allocations by other tasks. Any delta also includes a gc which
+# occurs during the section, so a negative value is possible.
+
+import gc
+from array import array
+from utime import ticks_us, ticks_diff
+
+class Profiler:
+    def __init__(self, names, depth=32, mem=True):
+        self.names = names
+        self._depth = depth
+        self._mem = mem
+        n = len(names)
+        self._us = array('i', (0 for _ in range(n * depth)))  # Durations
+        self._alloc = array('i', (0 for _ in range(n * depth)))  # Allocation deltas
+        self._pos = array('H', (0 for _ in range(n)))  # Next sample in ring
+        self._count = array('H', (0 for _ in range(n)))  # Samples in ring
+        self._t0 = array('i', (0 for _ in range(n)))  # Start of current part
+        self._m0 = array('i', (0 for _ in range(n)))  # mem_alloc at start
+        self._acc = array('i', (0 for _ in range(n)))  # Duration of earlier parts
+        self._part = bytearray(n)  # Nonzero if sample is in progress
+        self.overhead = 0
+        self.overhead = self._calibrate()
+
+    # Return the time in μs taken by a start() stop() pair. This is subtracted
+    # from each part of a sample.
+    def _calibrate(self):
+        t = ticks_us()
+        for _ in range(10):
+            self.start(0)
+            self.stop(0, True)
+        dt = ticks_diff(ticks_us(), t) // 10
+        self._acc[0] = 0
+        self._part[0] = 0
+        return dt
+
+    def start(self, n):
+        if self._mem and not self._part[n]:
+            self._m0[n] = gc.mem_alloc()
+        self._t0[n] = ticks_us()
+
+    def stop(self, n, partial=False):
+        dt = ticks_diff(ticks_us(), self._t0[n]) - self.overhead
+        self._acc[n] += dt if dt > 0 else 0
+        if partial:
+            self._part[n] = 1
+            return
+        i = n * self._depth + self._pos[n]
+        self._us[i] = self._acc[n]
+        if self._mem:
+            self._alloc[i] = gc.mem_alloc() - self._m0[n]
+        self._acc[n] = 0
+        self._part[n] = 0
+        self._pos[n] = (self._pos[n] + 1) % self._depth
+        if self._count[n] < self._depth:
+            self._count[n] += 1
+
+    # Discard all samples.
+    def reset(self):
+        for n in range(len(self.names)):
+            self._pos[n] = 0
+            self._count[n] = 0
+
+    # Return min, mean, p95, max duration in μs and mean allocation in bytes
+    # of section n, or None if it has no samples.
+    def stats(self, n):
+        count = self._count[n]
+        if not count:
+            return None
+        start = n * self._depth
+        us = sorted(self._us[start : start + count])
+        alloc = sum(self._alloc[start : start + count]) // count
+        return us[0], sum(us) // count, us[(count * 95) // 100], us[-1], alloc
+
+    def report(self):
+        print('{:10s}{:>8s}{:>8s}{:>8s}{:>8s}{:>8s}'.format('Section', 'min', 'mean', 'p95', 'max', 'alloc'))
+        total = 0
+        for n, name in enumerate(self.names):
+            s = self.stats(n)
+            if s is None:
+                print('{:10s}{:>8s}'.format(name, '-'))
+            else:
+                total += s[1]
+                print('{:10s}{:8d}{:8d}{:8d}{:8d}{:8d}'.format(name, *s))
+        print('Total mean {}μs. Overhead {}μs per section.'.format(total, self.overhead))
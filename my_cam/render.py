@@ -0,0 +1,200 @@
+# render.py Fast rendering of thermal images into a display's framebuffer
+
+# Released under the MIT licence.
+# Copyright (c) Peter Hinch 2019
+
+from array import array
+import framebuf
+
+_par = array('i', (0 for _ in range(7)))  # Args for Viper functions
+
+# Scaled copy of an image into a buffer. Elements are bytes (bpp == 1) or
+# 16 bit words (bpp == 2) in both src and buf.
+# par: cols, rows, scale, buffer width, x, y, bpp.
+@micropython.viper
+def _blit(src, buf, par):
+    p = ptr32(par)
+    cols = p[0]
+    rows = p[1]
+    scale = p[2]
+    bw = p[3]
+    y = p[5]
+    wide = p[6] == 2
+    s8 = ptr8(src)
+    d8 = ptr8(buf)
+    s16 = ptr16(src)
+    d16 = ptr16(buf)
+    for r in range(rows):
+        start = y * bw + p[4]  # First output pixel of row
+        x = start
+        for c in range(cols):
+            if wide:
+                v = s16[r * cols + c]
+                for _ in range(scale):
+                    d16[x] = v
+                    x += 1
+            else:
+                v = s8[r * cols + c]
+                for _ in range(scale):
+                    d8[x] = v
+                    x += 1
+        n = x - start
+        for _ in range(scale - 1):  # Replicate the row
+            y += 1
+            dst = y * bw + p[4]
+            for i in range(n):
+                if wide:
+                    d16[dst + i] = d16[start + i]
+                else:
+                    d8[dst + i] = d8[start + i]
+        y += 1
+
+# Scaled blit of color numbers into a GS8 buffer with ordered dithering.
+# par: cols, rows, scale, buffer width, x, y, table length.
+# Each output pixel takes its color from the dither table for its position.
+@micropython.viper
+def _dither(src, buf, dlut, par):
+    s = ptr8(src)
+    d = ptr8(buf)
+    t = ptr8(dlut)
+    p = ptr32(par)
+    cols = p[0]
+    rows = p[1]
+    scale = p[2]
+    bw = p[3]
+    x0 = p[4]
+    y = p[5]
+    tlen = p[6]
+    for r in range(rows):
+        for _ in range(scale):
+            start = y * bw
+            tbase = ((y & 3) << 2)
+            x = x0
+            for c in range(cols):
+                ci = int(s[r * cols + c])
+                for _ in range(scale):
+                    d[start + x] = t[(tbase | (x & 3)) * tlen + ci]
+                    x += 1
+            y += 1
+
+# The drivers' framebuf is a dummy if instantiated with buffered=False.
+def _check(ssd, cols, rows, scale, x, y, bpp):
+    if len(ssd.buffer) < ssd.width * ssd.height * bpp:
+        raise ValueError('Display has no framebuf.')
+    if x < 0 or y < 0 or x + cols * scale > ssd.width or y + rows * scale > ssd.height:
+        raise ValueError('Image does not fit the display.')
+
+# Draw an image of native colors (a bytearray for 8 bit displays, otherwise an
+# array('H') of rows * cols, as produced by Mapper.map_into) with each pixel
+# enlarged to scale * scale and its top left corner at x, y. Does not allocate.
+def blit(ssd, src, cols, rows, scale, x, y):
+    bpp = 1 if ssd.mode == framebuf.GS8 else 2
+    if isinstance(src, bytearray) != (bpp == 1):
+        raise ValueError('Image does not match display color format.')
+    if len(src) < cols * rows:
+        raise ValueError('Image is too small.')
+    _check(ssd, cols, rows, scale, x, y, bpp)
+    p = _par
+    p[0] = cols
+    p[1] = rows
+    p[2] = scale
+    p[3] = ssd.width
+    p[4] = x
+    p[5] = y
+    p[6] = bpp
+    _blit(src, ssd.buffer, p)
+
+# Draw an image of color numbers (a bytearray of rows * cols, as produced by
+# Mapper.map_into(src, dst, False)) on an 8 bit display with each pixel
+# enlarged to scale * scale. dlut is from Mapper.dither_lut(). Does not
+# allocate.
+def dither(ssd, src, cols, rows, scale, x, y, dlut):
+    if ssd.mode != framebuf.GS8:
+        raise ValueError('Dithering requires an 8 bit display.')
+    if len(src) < cols * rows:
+        raise ValueError('Image is too small.')
+    _check(ssd, cols, rows, scale, x, y, 1)
+    p = _par
+    p[0] = cols
+    p[1] = rows
+    p[2] = scale
+    p[3] = ssd.width
+    p[4] = x
+    p[5] = y
+    p[6] = len(dlut) // 16
+    _dither(src, ssd.buffer, dlut, p)
+
+# Render an interpolated image directly to a display without a framebuf, for
+# use with drivers instantiated with buffered=False. The image is computed a
+# band of rows at a time into a small buffer which is sent to the display's
+# address window. Total RAM is a few hundred bytes. The invert, reflect and
+# transpose args orient the image as in the camera demos.
+class Stream:
+    def __init__(self, ssd, mapper, cols=32, rows=32, scale=2, band=1,
+                 invert=False, reflect=False, transpose=False):
+        self.ssd = ssd
+        self.mapper = mapper
+        # Colors must be native
+        if hasattr(ssd, 'palette'):  # Indexed: use a reserved palette block
+            mapper.set_indexed(ssd)
+        else:
+            mapper.set_rgb(ssd.rgb)
+        self.cols = cols
+        self.rows = rows
+        self.scale = scale
+        self.band = band
+        self.invert = invert
+        self.reflect = reflect
+        self.transpose = transpose
+        self._bpp = 1 if ssd.mode == framebuf.GS8 else 2
+        n = cols * band
+        self._temps = array('f', (0 for _ in range(n)))
+        self._colors = bytearray(n) if self._bpp == 1 else array('H', (0 for _ in range(n)))
+        self._buf = bytearray(n * scale * scale * self._bpp)
+        self._par = array('i', (cols, band, scale, cols * scale, 0, 0, self._bpp))
+
+    # Read the interpolator, which must have been refreshed, and draw the
+    # image with its top left corner at x, y.
+    def show(self, interp, x, y):
+        cols = self.cols
+        rows = self.rows
+        scale = self.scale
+        mr = rows - 1
+        mc = cols - 1
+        temps = self._temps
+        par = self._par
+        buf = self._buf
+        for row0 in range(0, rows, self.band):
+            nrows = min(self.band, rows - row0)
+            i = 0
+            for row in range(row0, row0 + nrows):
+                for col in range(cols):
+                    r = mr - row if self.invert else row
+                    c = mc - col if self.reflect else col
+                    if self.transpose:
+                        r, c = c, r
+                    temps[i] = interp(r / mr, c / mc)
+                    i += 1
+            if nrows < self.band:  # Final partial band
+                temps = memoryview(temps)[: i]
+                buf = memoryview(buf)[: i * scale * scale * self._bpp]
+            self.mapper.map_into(temps, self._colors)
+            par[1] = nrows
+            _blit(self._colors, buf, par)
+            self.ssd.write_window(x, y + row0 * scale, cols * scale, nrows * scale, buf)
+
+# A small framebuf for drawing text or graphics on a display without a
+# framebuf. The Writer classes accept it as a device. show() sends it to the
+# display at x, y.
+class Strip(framebuf.FrameBuffer):
+    def __init__(self, ssd, width, height):
+        self.ssd = ssd
+        self.width = width  # Required by Writer class
+        self.height = height
+        self.mode = ssd.mode
+        self.rgb = ssd.rgb
+        self.buffer = bytearray(width * height * (1 if self.mode == framebuf.GS8 else 2))
+        super().__init__(self.buffer, width, height, self.mode)
+
+    def show(self, x, y):
+        self.ssd.write_window(x, y, self.width, self.height, self.buffer)
@@ -33,17 +33,24 @@ import framebuf
 import utime
 import gc
 import micropython
+import uasyncio as asyncio
+from micropython import const
+from array import array
 from uctypes import addressof
 
+# Dirty regions: maximum number tracked and distance (in pixels) within which
+# regions are merged. Merging bounds the number of transfers per show().
+_NRECTS = const(4)
+_MERGE = const(8)
+
 # Initialisation commands in cmd_init:
 # 0xfd, 0x12, 0xfd, 0xb1,  # Unlock command mode
 # 0xae,  # display off (sleep mode)
 # 0xb3, 0xf1,  # clock div
 # 0xca, 0x7f,  # mux ratio
-# 0xa0, 0x74,  # setremap 0x74
+# 0xa0, 0x64,  # setremap 0x64: COM scan COM0 -> COM127
 # 0x15, 0, 0x7f,  # setcolumn
 # 0x75, 0, 0x7f,  # setrow
-# 0xa1, 0,  # set display start line
 # 0xa2, 0,  # displayoffset
 # 0xb5, 0,  # setgpio
 # 0xab, 1,  # functionselect: serial interface, internal Vdd regulator
@@ -55,6 +62,24 @@ from uctypes import addressof
 # 0xb4, 0xa0, 0xb5, 0x55,  # set vsl (see datasheet re ext circuit)
 # 0xb6, 1,  # Precharge 2
 # 0xaf,  # Display on
+# 0xa1, n,  # set display start line: 96 (128 high) or 64 (96 high)
+
+# The remap and start line values cause framebuf row 0 to appear at the top
+# of the display with rows in natural order. This enables the framebuf to be
+# sent in a single transfer, and a region to be sent by setting the column
+# (0x15) and row (0x75) address window to its bounds.
+
+# Indexed mode: expand n palette indices starting at src[offs] to RGB565.
+# par: offs, n.
+@micropython.viper
+def _expand(src, dst, pal, par):
+    s = ptr8(src)
+    d = ptr16(dst)
+    p = ptr16(pal)
+    a = ptr32(par)
+    offs = a[0]
+    for i in range(a[1]):
+        d[i] = p[s[offs + i]]
 
 # SPI baudrate: Pyboard can produce 10.5MHz or 21MHz. Datasheet gives max of 20MHz.
 # Attempt to use 21MHz failed but might work on a PCB or with very short leads.
@@ -65,58 +90,297 @@ class SSD1351(framebuf.FrameBuffer):
     def rgb(r, g, b):
         return ((r & 0xf8) << 5) | ((g & 0x1c) << 11) | (b & 0xf8) | ((g & 0xe0) >> 5)
 
-    def __init__(self, spi, pincs, pindc, pinrs, height=128, width=128):
+    # In indexed mode the framebuf is GS8 and holds indices into a palette of
+    # 256 RGB565 colors. Rows are expanded to RGB565 as they are sent. This
+    # halves the RAM used by the framebuf.
+    # With buffered=False no framebuf is allocated: the application sends
+    # images with write_window(). FrameBuffer drawing methods have no visible
+    # effect.
+    def __init__(self, spi, pincs, pindc, pinrs, height=128, width=128,
+                 double=False, indexed=False, buffered=True):
         if height not in (96, 128):
             raise ValueError('Unsupported height {}'.format(height))
+        if double and not buffered:
+            raise ValueError('Double buffering requires a framebuf.')
         self.spi = spi
         self.rate = 11000000  # See baudrate note above.
         self.pincs = pincs
         self.pindc = pindc  # 1 = data 0 = cmd
         self.height = height  # Required by Writer class
         self.width = width
+        self._indexed = indexed
+        if indexed:
+            self.palette = array('H', (0 for _ in range(256)))
+            self._ncolors = 1  # Entry 0 is black
+            self._top = 256  # Entries from here up are reserved
+            self.rgb = self._rgb_index  # Instance attribute hides staticmethod
+            self._linebuf = bytearray(width * 2)
+            self._mvl = memoryview(self._linebuf)
+            self._xpar = array('i', (0, 0))  # Args for _expand
         # Save color mode for use by writer_gui (blit)
-        self.mode = framebuf.RGB565
+        self.mode = framebuf.GS8 if indexed else framebuf.RGB565
         gc.collect()
-        self.buffer = bytearray(self.height * self.width * 2)
-        super().__init__(self.buffer, self.width, self.height, self.mode)
+        self._buffered = buffered
+        if buffered:
+            self.buffer = bytearray(self.height * self.width * (1 if indexed else 2))
+            super().__init__(self.buffer, self.width, self.height, self.mode)
+        else:
+            # FrameBuffer rejects a size of 0 so use a 1x1 dummy
+            self.buffer = bytearray(1 if indexed else 2)
+            super().__init__(self.buffer, 1, 1, self.mode)
         self.mvb = memoryview(self.buffer)
+        # With double buffering the application draws to .buffer while the
+        # front buffer is sent. Otherwise they are the same object.
+        self._double = double
+        self._front = bytearray(len(self.buffer)) if double else self.buffer
+        self._mvf = memoryview(self._front)
+        self._busy = False  # Asynchronous transfer in progress
+        self._rects = [[0, 0, 0, 0] for _ in range(_NRECTS)]  # x0, y0, x1, y1
+        self._nrects = 0
+        self._par = bytearray(2)  # Command parameters
         pinrs(0)  # Pulse the reset line
         utime.sleep_ms(1)
         pinrs(1)
         utime.sleep_ms(1)
+        self._spi_init()
         # See above comment to explain this allocation-saving gibberish.
-        self._write(b'\xfd\x12\xfd\xb1\xae\xb3\xf1\xca\x7f\xa0\x74'\
-        b'\x15\x00\x7f\x75\x00\x7f\xa1\x00\xa2\x00\xb5\x00\xab\x01'\
+        self._write(b'\xfd\x12\xfd\xb1\xae\xb3\xf1\xca\x7f\xa0\x64'\
+        b'\x15\x00\x7f\x75\x00\x7f\xa2\x00\xb5\x00\xab\x01'\
         b'\xb1\x32\xbe\x05\xa6\xc1\xc8\x80\xc8\xc7\x0f'\
         b'\xb4\xa0\xb5\x55\xb6\x01\xaf', 0)
-        self.show()
+        self._write(b'\xa1\x60' if height == 128 else b'\xa1\x40', 0)
+        if buffered:
+            self.show()
+        else:  # Clear the display one row at a time
+            row = bytearray(width * (1 if indexed else 2))
+            for y in range(height):
+                self.write_window(0, y, width, 1, row)
         gc.collect()
 
-    def _write(self, mv, dc):
+    # Indexed mode: return the palette index of a color, adding it to the
+    # palette if necessary. Entries are never freed: a Mapper should use a
+    # reserved block (Mapper.set_indexed) rather than ssd.rgb.
+    def _rgb_index(self, r, g, b):
+        c = SSD1351.rgb(r, g, b)
+        pal = self.palette
+        for i in range(self._ncolors):
+            if pal[i] == c:
+                return i
+        if self._ncolors >= self._top:
+            raise ValueError('Palette is full.')
+        i = self._ncolors
+        pal[i] = c
+        self._ncolors += 1
+        return i
+
+    # Indexed mode: reserve n entries at the top of the palette. ssd.rgb() will
+    # not allocate them. Return the index of the first entry.
+    def reserve(self, n):
+        if not self._indexed:
+            raise ValueError('Display is not indexed.')
+        if n < 1 or self._top - n < self._ncolors:
+            raise ValueError('Palette is full.')
+        self._top -= n
+        return self._top
+
+    # Indexed mode: set palette entries from base onwards to the colors in
+    # bytearrays r, g, b.
+    def set_colors(self, base, r, g, b):
+        pal = self.palette
+        for i in range(len(r)):
+            pal[base + i] = SSD1351.rgb(r[i], g[i], b[i])
+
+    # The bus may be shared with devices having other settings: initialise it
+    # once before each group of writes.
+    def _spi_init(self):
         self.spi.init(baudrate=self.rate, polarity=1, phase=1)
+
+    def _write(self, mv, dc):
         self.pincs(1)
         self.pindc(dc)
         self.pincs(0)
-        self.spi.write(bytes(mv))
+        self.spi.write(mv)
         self.pincs(1)
 
-    # Write lines from the framebuf out of order to match the mapping of the
-    # SSD1351 RAM to the OLED device.
+    # Send a command with two parameters.
+    def _wcd(self, cmd, a, b):
+        par = self._par
+        par[0] = a
+        par[1] = b
+        self._write(cmd, 0)
+        self._write(par, 1)
+
+    # Set the RAM address window and enable data write.
+    def _window(self, x0, y0, x1, y1):
+        self._wcd(b'\x15', x0, x1)
+        self._wcd(b'\x75', y0, y1)
+        self._write(b'\x5c', 0)
+
+    # Send columns x0..x1 of rows y..ye - 1 of buffer mvb whose rows are w
+    # pixels wide. CS must be low and DC set for data.
+    def _rows(self, mvb, w, x0, x1, y, ye):
+        spi = self.spi
+        n = x1 - x0 + 1  # Pixels per row
+        if self._indexed:
+            par = self._xpar
+            par[1] = n
+            lb = self._linebuf if n == self.width else self._mvl[: n * 2]
+            for row in range(y, ye):
+                par[0] = row * w + x0
+                _expand(mvb, lb, self.palette, par)
+                spi.write(lb)
+        elif n == w:  # Rows are contiguous
+            spi.write(mvb[y * w * 2 : ye * w * 2])
+        else:
+            for row in range(y, ye):
+                start = (row * w + x0) * 2
+                spi.write(mvb[start : start + n * 2])
+
+    # Send an image of w * h pixels in buf (native colors or, in indexed mode,
+    # palette indices, rows in order) to the display with its top left corner
+    # at x, y. The area must lie within the display. Does not use or alter the
+    # framebuf. Raises RuntimeError during show_async() as it would move the
+    # window being sent.
+    def write_window(self, x, y, w, h, buf):
+        if self._busy:
+            raise RuntimeError('Asynchronous transfer in progress.')
+        self._spi_init()
+        self._window(x, y, x + w - 1, y + h - 1)
+        if self._indexed:
+            self.pindc(1)
+            self.pincs(0)
+            self._rows(buf, w, 0, w - 1, 0, h)
+            self.pincs(1)
+        else:
+            self._write(buf, 1)
+
+    # Mark a region as changed. If any regions are marked, the next show()
+    # sends only those regions, otherwise it sends the whole framebuf.
+    def dirty(self, x, y, w, h):
+        x0 = max(x, 0)
+        y0 = max(y, 0)
+        x1 = min(x + w, self.width) - 1
+        y1 = min(y + h, self.height) - 1
+        if x1 < x0 or y1 < y0:
+            return
+        rects = self._rects
+        n = self._nrects
+        for i in range(n):
+            if self._near(rects[i], x0, y0, x1, y1):
+                break
+        else:
+            if n < _NRECTS:
+                r = rects[n]
+                r[0], r[1], r[2], r[3] = x0, y0, x1, y1
+                self._nrects += 1
+                return
+            # No free slot: merge with the region whose area grows least
+            grow = lambda r : ((max(r[2], x1) - min(r[0], x0) + 1) * (max(r[3], y1) - min(r[1], y0) + 1)
+                               - (r[2] - r[0] + 1) * (r[3] - r[1] + 1))
+            i = min(range(n), key=lambda i : grow(rects[i]))
+        r = rects[i]
+        r[0], r[1] = min(r[0], x0), min(r[1], y0)
+        r[2], r[3] = max(r[2], x1), max(r[3], y1)
+        # The enlarged region may now be near others: absorb them
+        j = 0
+        while j < self._nrects:
+            s = rects[j]
+            if s is not r and self._near(r, s[0], s[1], s[2], s[3]):
+                r[0], r[1] = min(r[0], s[0]), min(r[1], s[1])
+                r[2], r[3] = max(r[2], s[2]), max(r[3], s[3])
+                self._nrects -= 1
+                last = rects[self._nrects]  # Move last region into slot j
+                rects[j], rects[self._nrects] = last, s
+                j = 0
+            else:
+                j += 1
+
+    @staticmethod
+    def _near(r, x0, y0, x1, y1):
+        return (x0 <= r[2] + _MERGE and r[0] <= x1 + _MERGE and
+                y0 <= r[3] + _MERGE and r[1] <= y1 + _MERGE)
+
+    def _send_rect(self, x0, y0, x1, y1):
+        self._window(x0, y0, x1, y1)
+        self.pindc(1)
+        self.pincs(0)
+        self._rows(self._mvf, self.width, x0, x1, y0, y1 + 1)
+        self.pincs(1)
+
+    # Double buffering: the completed frame becomes the front buffer. Drawing
+    # continues in the other buffer, which is rebound to the framebuf and
+    # initialised with a copy of the completed frame.
+    def _swap(self):
+        self.buffer, self._front = self._front, self.buffer
+        self.mvb, self._mvf = self._mvf, self.mvb
+        super().__init__(self.buffer, self.width, self.height, self.mode)
+        self.mvb[:] = self._mvf
+
+    # True while show_async is sending a frame.
+    def busy(self):
+        return self._busy
+
+    # Wait until any transfer started by show_async is complete.
+    async def wait(self):
+        while self._busy:
+            await asyncio.sleep_ms(0)
+
+    # Send marked regions or, if none are marked, the entire framebuf. Except
+    # in indexed mode the framebuf is sent in one transfer with no allocation.
     def show(self):
-        mvb = self.mvb 
-        bw = self.width * 2  # Width in bytes
-        self._write(b'\x5c', 0)  # Enable data write
-        if self.height == 128:
-            for l in range(128):
-                l0 = (95 - l) % 128  # 95 94 .. 1 0 127 126 .. 96
-                start = l0 * self.width * 2
-                self._write(mvb[start : start + bw], 1)  # Send a line
+        if self._busy:
+            raise RuntimeError('Asynchronous transfer in progress.')
+        if not self._buffered:
+            return
+        if self._double:
+            self._swap()
+        self._spi_init()
+        if self._nrects:
+            for i in range(self._nrects):
+                r = self._rects[i]
+                self._send_rect(r[0], r[1], r[2], r[3])
+            self._nrects = 0
         else:
-            for l in range(128):
-                if l < 64:
-                    start = (63 -l) * self.width * 2  # 63 62 .. 1 0
-                elif l < 96:
-                    start = 0
-                else:
-                    start = (191 - l) * self.width * 2  # 127 126 .. 95
-                self._write(mvb[start : start + bw], 1)  # Send a line
+            self._send_rect(0, 0, self.width - 1, self.height - 1)
+
+    # Asynchronous show(). Data is sent in chunks of about chunk bytes with a
+    # yield to the scheduler after each so that other tasks run during the
+    # transfer. Without double buffering this returns when the transfer is
+    # complete and tasks must not draw to the framebuf until then. With double
+    # buffering the frame is sent by a background task and this returns at
+    # once: drawing of the next frame may proceed immediately.
+    async def show_async(self, chunk=2048):
+        await self.wait()  # Previous frame has been sent
+        if not self._buffered:
+            return
+        # Copy marked regions: tasks may mark more while the frame is sent.
+        rects = self._rects
+        regions = [tuple(rects[i]) for i in range(self._nrects)]
+        self._nrects = 0
+        if not regions:
+            regions.append((0, 0, self.width - 1, self.height - 1))
+        self._busy = True
+        if self._double:
+            self._swap()
+            asyncio.create_task(self._send_async(regions, chunk))
+        else:
+            await self._send_async(regions, chunk)
+
+    async def _send_async(self, regions, chunk):
+        try:
+            for x0, y0, x1, y1 in regions:
+                self._spi_init()
+                self._window(x0, y0, x1, y1)
+                k = max(chunk // ((x1 - x0 + 1) * 2), 1)  # Rows per chunk
+                y = y0
+                while y <= y1:
+                    ye = min(y + k, y1 + 1)
+                    self._spi_init()  # Another task may have used the bus
+                    self.pindc(1)
+                    self.pincs(0)
+                    self._rows(self._mvf, self.width, x0, x1, y, ye)
+                    self.pincs(1)
+                    y = ye
+                    await asyncio.sleep_ms(0)
+        finally:
+            self._busy = False
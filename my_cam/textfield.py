@@ -0,0 +1,79 @@
+# textfield.py Text field which redraws only changed characters.
+
+# Released under the MIT licence.
+# Copyright (c) Peter Hinch 2019
+
+# A TextField occupies a fixed area of a display: a row of text in a Writer's
+# font, width pixels wide with top left corner at row, col. Each value() call
+# formats its args and redraws only character cells which have changed. It
+# returns the bounding box of the redrawn area for use with a display's
+# dirty() method, or None if nothing changed.
+# Usage:
+# field = TextField(wri, 66, 40, 60, '{:+4d}C')
+# r = field.value(27)
+# if r is not None:
+#     ssd.dirty(*r)
+# Upside down displays are not supported.
+
+from writer import Writer
+
+class TextField:
+    def __init__(self, writer, row, col, width, fmt='{}', invert=False):
+        device = writer.device
+        if col < 0 or row < 0 or col + width > device.width or row + writer.height > device.height:
+            raise ValueError('Field does not fit the display.')
+        self.writer = writer
+        self.row = row
+        self.col = col
+        self.width = width
+        self.fmt = fmt
+        self.invert = invert
+        self._text = ''  # As drawn
+        self._end = col  # End column of drawn text
+        self._colors = None  # Colors of drawn text
+
+    # Force a complete redraw on the next value() call.
+    def clear(self):
+        self._text = ''
+
+    def value(self, *args):
+        wri = self.writer
+        device = wri.device
+        row = self.row
+        text = self.fmt.format(*args)
+        colors = (wri.fgcolor, wri.bgcolor)
+        old = self._text if colors == self._colors else ''
+        self._colors = colors
+        xend = self.col + self.width
+        x = self.col  # Start of current cell
+        ox = x  # Start of corresponding cell of old text
+        x0 = None  # Bounds of redrawn area
+        x1 = x
+        for i, ch in enumerate(text):
+            w = wri.charlen(ch)
+            if x + w > xend:  # Truncate to field width
+                text = text[:i]
+                break
+            same = False
+            if i < len(old):
+                oc = old[i]
+                same = oc == ch and ox == x
+                ox += wri.charlen(oc)
+            if not same:
+                Writer.set_textpos(device, row, x)
+                wri.printstring(ch, self.invert)
+                if x0 is None:
+                    x0 = x
+                x1 = x + w
+            x += w
+        if self._end > x:  # Old text was longer: clear the remainder
+            bg = wri.fgcolor if self.invert else wri.bgcolor
+            device.fill_rect(x, row, self._end - x, wri.height, bg)
+            if x0 is None:
+                x0 = x
+            x1 = self._end
+        self._text = text
+        self._end = x
+        if x0 is None:
+            return None
+        return x0, row, x1 - x0, wri.height
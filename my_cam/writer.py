@@ -31,8 +31,22 @@
 # Timings based on a 20 pixel high proportional font, run on a pyboard V1.0.
 # Using CWriter's slow rendering: _printchar 9.5ms typ, 13.5ms max.
 # Using Writer's fast rendering: _printchar 115μs min 480μs typ 950μs max.
+# CWriter renders as fast as Writer where firmware supports the palette arg
+# of FrameBuffer.blit (V1.20 and later), except on upside down displays.
 
 import framebuf
+from ucollections import OrderedDict
+
+# Test for support of the palette arg of FrameBuffer.blit
+def _palette_ok():
+    fb = framebuf.FrameBuffer(bytearray(2), 2, 1, framebuf.GS8)
+    try:
+        fb.blit(fb, 0, 0, -1, fb)
+    except TypeError:  # Too many args
+        return False
+    return True
+
+_PALETTE = _palette_ok()
 
 class DisplayState():
     def __init__(self):
@@ -40,6 +54,106 @@ class DisplayState():
         self.text_col = 0
         self.usd = False
 
+# LRU cache of rendered strings shared by all Writer instances. Entries are
+# mono FrameBuffers in font format: CWriter applies colors via the blit
+# palette so an entry serves any colors. Total buffer size is limited to
+# budget bytes. Entries are keyed by string, with a list of variants for each
+# font and invert flag, so that a hit does not allocate a key. The variants
+# of a string are used and evicted together.
+class _Cache:
+    def __init__(self, budget):
+        self.budget = budget
+        self.nbytes = 0
+        self.entries = 0
+        self.hits = 0
+        self.misses = 0
+        self._d = OrderedDict()  # string: [[font, inv, (fb, width, nbytes)], ...]
+
+    def get(self, string, font, inv):
+        d = self._d
+        if string in d:
+            variants = d.pop(string)
+            d[string] = variants  # Now most recently used
+            for v in variants:
+                if v[0] is font and v[1] == inv:
+                    self.hits += 1
+                    return v[2]
+        self.misses += 1
+        return None
+
+    def put(self, string, font, inv, entry):
+        nbytes = entry[2]
+        if nbytes > self.budget:
+            return
+        d = self._d
+        while self.nbytes + nbytes > self.budget:  # Evict least recently used
+            for v in d.pop(next(iter(d))):
+                self.nbytes -= v[2][2]
+                self.entries -= 1
+        if string in d:
+            d[string].append([font, inv, entry])
+        else:
+            d[string] = [[font, inv, entry]]
+        self.nbytes += nbytes
+        self.entries += 1
+
+# Wraps a font module, presenting the same interface. Glyphs and widths are
+# looked up once at instantiation so get_ch does no index decoding and
+# stringlen is a table lookup per character. Costs a few bytes per glyph.
+# Not for compressed fonts, whose glyphs would all be decompressed.
+# Usage: wri = CWriter(ssd, FontIndex(arial10), fg, bg)
+class FontIndex:
+    def __init__(self, font):
+        self.font = font
+        # Fonts from early versions of font_to_py lack min_ch and max_ch
+        self._min = font.min_ch() if hasattr(font, 'min_ch') else 32
+        self._max = font.max_ch() if hasattr(font, 'max_ch') else 126
+        self._height = font.height()
+        n = self._max - self._min + 1
+        self.widths = bytearray(n)
+        self._glyphs = []
+        for i in range(n):
+            glyph, _, width = font.get_ch(chr(self._min + i))
+            self.widths[i] = width
+            self._glyphs.append(glyph)
+
+    def height(self):
+        return self._height
+
+    def max_width(self):
+        return self.font.max_width()
+
+    def hmap(self):
+        return self.font.hmap()
+
+    def reverse(self):
+        return self.font.reverse()
+
+    def monospaced(self):
+        return self.font.monospaced()
+
+    def min_ch(self):
+        return self._min
+
+    def max_ch(self):
+        return self._max
+
+    def get_ch(self, ch):
+        i = ord(ch) - self._min
+        if 0 <= i <= self._max - self._min:
+            return self._glyphs[i], self._height, self.widths[i]
+        return self.font.get_ch(ch)  # Font substitutes a default
+
+    def stringlen(self, string):
+        widths = self.widths
+        lo = self._min
+        n = self._max - lo
+        l = 0
+        for char in string:
+            i = ord(char) - lo
+            l += widths[i] if 0 <= i <= n else self.font.get_ch(char)[2]
+        return l
+
 def _get_id(device):
     if not isinstance(device, framebuf.FrameBuffer):
         raise ValueError('Device must be derived from FrameBuffer.')
@@ -49,6 +163,30 @@ def _get_id(device):
 class Writer():
 
     state = {}  # Holds a display state for each device
+    cache = None  # Rendered string cache: see set_cache
+    glyphs = None  # Decompressed glyph cache: see set_glyph_cache
+
+    # Cache rendered strings in up to nbytes of RAM. Repeated text is then
+    # drawn with a single blit. 0 disables the cache.
+    @staticmethod
+    def set_cache(nbytes):
+        Writer.cache = _Cache(nbytes) if nbytes else None
+
+    # Compressed fonts (see font_rle.py) are decompressed a glyph at a time
+    # into a cache of up to nbytes of RAM, shared by all Writers. The cache is
+    # created with a default size when a Writer first uses such a font.
+    @staticmethod
+    def set_glyph_cache(nbytes):
+        Writer.glyphs = _Cache(max(nbytes, 1))
+
+    # Return no. of entries, bytes used, hits and misses for the string cache
+    # or, if glyphs is True, for the glyph cache.
+    @staticmethod
+    def cache_info(glyphs=False):
+        c = Writer.glyphs if glyphs else Writer.cache
+        if c is None:
+            return 0, 0, 0, 0
+        return c.entries, c.nbytes, c.hits, c.misses
 
     @staticmethod
     def set_textpos(device, row=None, col=None):
@@ -96,6 +234,14 @@ class Writer():
         self.glyph = None  # Current char
         self.char_height = 0
         self.char_width = 0
+        # Glyphs are copied to a buffer because FrameBuffer requires a
+        # writeable buffer.
+        self._gbuf = bytearray(((font.max_width() + 7) // 8) * font.height())
+        self._gmv = memoryview(self._gbuf)
+        self._palette = None  # Used by CWriter
+        self._rle = hasattr(font, 'compressed') and font.compressed()
+        if self._rle and Writer.glyphs is None:
+            Writer.set_glyph_cache(1024)
 
     def _getstate(self):
         return Writer.state[self.devid]
@@ -148,36 +294,117 @@ class Writer():
                 string = lines[1]
 
     def _printline(self, string, invert):
+        if self._cached(string, invert):
+            return
         rstr = None
-        if self.wrap and self.stringlen(string) > self.screenwidth:
-            pos = 0
-            lstr = string[:]
-            while self.stringlen(lstr) > self.screenwidth:
-                pos = lstr.rfind(' ')
-                lstr = lstr[:pos].rstrip()
+        if self.wrap:
+            pos = self._wrap(string)
             if pos > 0:
                 rstr = string[pos + 1:]
-                string = lstr
-                
+                string = string[:pos].rstrip()
+
         for char in string:
             self._printchar(char, invert)
         if rstr is not None:
             self._printchar('\n')
             self._printline(rstr, invert)  # Recurse
 
+    # Draw a string from the cache, rendering it if necessary. Return False if
+    # it must be drawn a character at a time: the cache is disabled, the
+    # display is upside down or the string does not fit the current row.
+    def _cached(self, string, invert):
+        cache = Writer.cache
+        if cache is None or self.usd or '\t' in string:
+            return False
+        s = self._getstate()
+        if s.text_row + self.font.height() > self.screenheight:
+            return False
+        inv = invert and self._palette is None  # CWriter inverts via palette
+        entry = cache.get(string, self.font, inv)
+        if entry is None:
+            if s.text_col + self.stringlen(string) > self.screenwidth:
+                return False
+            entry = self._render(string, inv)
+            cache.put(string, self.font, inv, entry)
+        fb, width, _ = entry
+        if s.text_col + width > self.screenwidth:
+            return False
+        self._blitstr(fb, s, invert)
+        s.text_col += width
+        self.cpos += len(string)
+        return True
+
+    # Return (fb, width, nbytes) for a string rendered in font format.
+    def _render(self, string, invert):
+        font = self.font
+        width = self.stringlen(string)
+        height = font.height()
+        nbytes = ((width + 7) // 8) * height
+        buf = bytearray(nbytes)
+        fb = framebuf.FrameBuffer(buf, width, height, self.map)
+        x = 0
+        for char in string:
+            glyph, char_height, char_width = self._get_ch(char)
+            self._gmv[: len(glyph)] = glyph
+            fb.blit(framebuf.FrameBuffer(self._gbuf, char_width, char_height, self.map), x, 0)
+            x += char_width
+        if invert:
+            for i, v in enumerate(buf):
+                buf[i] = 0xFF & ~ v
+        return fb, width, nbytes
+
+    def _blitstr(self, fb, s, invert):
+        self.device.blit(fb, s.text_col, s.text_row)
+
+    # If string is wider than the screen return the index of the last space
+    # at which it can be broken so that the text before it fits, otherwise -1.
+    # Each character is measured once.
+    def _wrap(self, string):
+        sw = self.screenwidth
+        l = 0  # Width of string so far
+        lword = 0  # Width up to the end of the last word
+        pos = -1
+        for i, char in enumerate(string):
+            l += self._charlen(char)
+            if char != ' ':
+                lword = l
+            elif lword > sw:  # Text before this space is too wide
+                return pos
+            else:
+                pos = i
+        return -1 if l <= sw else pos
+
     def stringlen(self, string):
+        if hasattr(self.font, 'stringlen'):  # FontIndex
+            return self.font.stringlen(string)
         l = 0
         for char in string:
             l += self._charlen(char)
         return l
 
-    def _charlen(self, char):
+    # Width in pixels of a single character.
+    def charlen(self, char):
         if char == '\n':
             char_width = 0
         else:
-            _, _, char_width = self.font.get_ch(char)
+            char_width = self.font.get_width(char) if self._rle else self.font.get_ch(char)[2]
         return char_width
 
+    _charlen = charlen
+
+    # As font.get_ch but using the glyph cache for compressed fonts.
+    def _get_ch(self, char):
+        font = self.font
+        if not self._rle:
+            return font.get_ch(char)
+        entry = Writer.glyphs.get(char, font, False)
+        if entry is None:
+            height, width = font.unpack(char, self._gbuf)
+            n = ((width + 7) // 8) * height
+            entry = (bytearray(self._gmv[: n]), width, n)
+            Writer.glyphs.put(char, font, False, entry)
+        return entry[0], font.height(), entry[1]
+
     def _get_char(self, char, recurse):
         if not recurse:  # Handle tabs
             if char == '\n':
@@ -196,7 +423,7 @@ class Writer():
         if char == '\n':
             self._newline()
             return
-        glyph, char_height, char_width = self.font.get_ch(char)
+        glyph, char_height, char_width = self._get_ch(char)
         s = self._getstate()
         if self.usd:
             if s.text_row - char_height < 0:
@@ -229,10 +456,12 @@ class Writer():
         self._get_char(char, recurse)
         if self.glyph is None:
             return  # All done
-        buf = bytearray(self.glyph)
+        n = len(self.glyph)
+        buf = self._gbuf
+        self._gmv[: n] = self.glyph
         if invert:
-            for i, v in enumerate(buf):
-                buf[i] = 0xFF & ~ v
+            for i in range(n):
+                buf[i] = 0xFF & ~ buf[i]
         fbc = framebuf.FrameBuffer(buf, self.char_width, self.char_height, self.map)
         self.device.blit(fbc, s.text_col, s.text_row)
         s.text_col += self.char_width
@@ -264,6 +493,11 @@ class CWriter(Writer):
             self.fgcolor = fgcolor
         self.def_bgcolor = self.bgcolor
         self.def_fgcolor = self.fgcolor
+        # Fast rendering blits the mono glyph using a palette holding the
+        # background and foreground colors.
+        mode = getattr(device, 'mode', None)
+        if _PALETTE and mode is not None:
+            self._palette = framebuf.FrameBuffer(bytearray(4), 2, 1, mode)
 
     def setcolor(self, fgcolor=None, bgcolor=None):
         if fgcolor is None and bgcolor is None:
@@ -281,6 +515,27 @@ class CWriter(Writer):
         self._get_char(char, recurse)
         if self.glyph is None:
             return  # All done
+        if self._palette is None or self.usd:
+            self._slowchar(s, invert)
+            return
+        self._gmv[: len(self.glyph)] = self.glyph
+        fbc = framebuf.FrameBuffer(self._gbuf, self.char_width, self.char_height, self.map)
+        self._blitstr(fbc, s, invert)
+        s.text_col += self.char_width
+        self.cpos += 1
+
+    # The cache is only used with palette rendering.
+    def _cached(self, string, invert):
+        return self._palette is not None and super()._cached(string, invert)
+
+    def _blitstr(self, fb, s, invert):
+        palette = self._palette
+        palette.pixel(0, 0, self.fgcolor if invert else self.bgcolor)
+        palette.pixel(1, 0, self.bgcolor if invert else self.fgcolor)
+        self.device.blit(fb, s.text_col, s.text_row, -1, palette)
+
+    # Render pixel by pixel: for old firmware and upside down displays.
+    def _slowchar(self, s, invert):
         char_height = self.char_height
         char_width = self.char_width
 
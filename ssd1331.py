@@ -25,6 +25,7 @@
 
 # Show command
 # 0x15, 0, 0x5f, 0x75, 0, 0x3f  Col 0-95 row 0-63
+# Partial refresh uses the same commands with the bounds of the region.
 
 # Initialisation command
 # 0xae        display off (sleep mode)
@@ -49,6 +50,13 @@
 import framebuf
 import utime
 import gc
+from micropython import const
+import uasyncio as asyncio
+
+# Dirty regions: maximum number tracked and distance (in pixels) within which
+# regions are merged. Merging bounds the number of transfers per show().
+_NRECTS = const(4)
+_MERGE = const(8)
 
 class SSD1331(framebuf.FrameBuffer):
     # Convert r, g, b in range 0-255 to an 8 bit colour value
@@ -57,7 +65,13 @@ class SSD1331(framebuf.FrameBuffer):
     def rgb(r, g, b):
         return (r & 0xe0) | ((g >> 3) & 0x1c) | (b >> 6)
 
-    def __init__(self, spi, pincs, pindc, pinrs, height=64, width=96):
+    # With buffered=False no framebuf is allocated: the application sends
+    # images with write_window(). FrameBuffer drawing methods have no visible
+    # effect.
+    def __init__(self, spi, pincs, pindc, pinrs, height=64, width=96,
+                 double=False, buffered=True):
+        if double and not buffered:
+            raise ValueError('Double buffering requires a framebuf.')
         self.spi = spi
         self.rate = 6660000  # Data sheet: 150ns min clock period
         self.pincs = pincs
@@ -67,8 +81,24 @@ class SSD1331(framebuf.FrameBuffer):
         # Save color mode for use by writer_gui (blit)
         self.mode = framebuf.GS8  # Use 8bit greyscale for 8 bit color.
         gc.collect()
-        self.buffer = bytearray(self.height * self.width)
-        super().__init__(self.buffer, self.width, self.height, self.mode)
+        self._buffered = buffered
+        if buffered:
+            self.buffer = bytearray(self.height * self.width)
+            super().__init__(self.buffer, self.width, self.height, self.mode)
+        else:
+            # FrameBuffer rejects a size of 0 so use a 1x1 dummy
+            self.buffer = bytearray(1)
+            super().__init__(self.buffer, 1, 1, self.mode)
+        self.mvb = memoryview(self.buffer)
+        # With double buffering the application draws to .buffer while the
+        # front buffer is sent. Otherwise they are the same object.
+        self._double = double
+        self._front = bytearray(len(self.buffer)) if double else self.buffer
+        self._mvf = memoryview(self._front)
+        self._busy = False  # Asynchronous transfer in progress
+        self._rects = [[0, 0, 0, 0] for _ in range(_NRECTS)]  # x0, y0, x1, y1
+        self._nrects = 0
+        self._cmd = bytearray(b'\x15\x00\x00\x75\x00\x00')  # Window
         pinrs(0)  # Pulse the reset line
         utime.sleep_ms(1)
         pinrs(1)
@@ -77,7 +107,11 @@ class SSD1331(framebuf.FrameBuffer):
         b'\x0b\xb1\x31\xb3\xf0\x8a\x64\x8b\x78\x8c\x64\xbb\x3a\xbe\x3e\x87'\
         b'\x06\x81\x91\x82\x50\x83\x7d\xaf', 0)
         gc.collect()
-        self.show()
+        if buffered:
+            self.show()
+        else:  # Clear the display
+            self._write(b'\x25\x00\x00\x5f\x3f', 0)
+            utime.sleep_ms(1)
 
     def _write(self, buf, dc):
         self.spi.init(baudrate=self.rate, polarity=1, phase=1)
@@ -87,6 +121,175 @@ class SSD1331(framebuf.FrameBuffer):
         self.spi.write(buf)
         self.pincs(1)
 
+    # Send an image of w * h pixels in buf (rrrgggbb, rows in order) to the
+    # display with its top left corner at x, y. The area must lie within the
+    # display. Does not use or alter the framebuf. Raises RuntimeError during
+    # show_async() as it would move the window being sent.
+    def write_window(self, x, y, w, h, buf):
+        if self._busy:
+            raise RuntimeError('Asynchronous transfer in progress.')
+        cmd = self._cmd
+        cmd[1] = x
+        cmd[2] = x + w - 1
+        cmd[4] = y
+        cmd[5] = y + h - 1
+        self._write(cmd, 0)
+        self._write(buf, 1)
+
+    # Mark a region as changed. If any regions are marked, the next show()
+    # sends only those regions, otherwise it sends the whole framebuf.
+    def dirty(self, x, y, w, h):
+        x0 = max(x, 0)
+        y0 = max(y, 0)
+        x1 = min(x + w, self.width) - 1
+        y1 = min(y + h, self.height) - 1
+        if x1 < x0 or y1 < y0:
+            return
+        rects = self._rects
+        n = self._nrects
+        for i in range(n):
+            if self._near(rects[i], x0, y0, x1, y1):
+                break
+        else:
+            if n < _NRECTS:
+                r = rects[n]
+                r[0], r[1], r[2], r[3] = x0, y0, x1, y1
+                self._nrects += 1
+                return
+            # No free slot: merge with the region whose area grows least
+            grow = lambda r : ((max(r[2], x1) - min(r[0], x0) + 1) * (max(r[3], y1) - min(r[1], y0) + 1)
+                               - (r[2] - r[0] + 1) * (r[3] - r[1] + 1))
+            i = min(range(n), key=lambda i : grow(rects[i]))
+        r = rects[i]
+        r[0], r[1] = min(r[0], x0), min(r[1], y0)
+        r[2], r[3] = max(r[2], x1), max(r[3], y1)
+        # The enlarged region may now be near others: absorb them
+        j = 0
+        while j < self._nrects:
+            s = rects[j]
+            if s is not r and self._near(r, s[0], s[1], s[2], s[3]):
+                r[0], r[1] = min(r[0], s[0]), min(r[1], s[1])
+                r[2], r[3] = max(r[2], s[2]), max(r[3], s[3])
+                self._nrects -= 1
+                last = rects[self._nrects]  # Move last region into slot j
+                rects[j], rects[self._nrects] = last, s
+                j = 0
+            else:
+                j += 1
+
+    @staticmethod
+    def _near(r, x0, y0, x1, y1):
+        return (x0 <= r[2] + _MERGE and r[0] <= x1 + _MERGE and
+                y0 <= r[3] + _MERGE and r[1] <= y1 + _MERGE)
+
+    def _send_rect(self, x0, y0, x1, y1):
+        cmd = self._cmd
+        cmd[1] = x0
+        cmd[2] = x1
+        cmd[4] = y0
+        cmd[5] = y1
+        self._write(cmd, 0)
+        mvb = self._mvf
+        w = self.width
+        if x0 == 0 and x1 == w - 1:  # Rows are contiguous
+            self._write(mvb[y0 * w : (y1 + 1) * w], 1)
+            return
+        spi = self.spi
+        self.pincs(1)
+        self.pindc(1)
+        self.pincs(0)
+        for y in range(y0, y1 + 1):
+            start = y * w + x0
+            spi.write(mvb[start : start + x1 - x0 + 1])
+        self.pincs(1)
+
+    # Double buffering: the completed frame becomes the front buffer. Drawing
+    # continues in the other buffer, which is rebound to the framebuf and
+    # initialised with a copy of the completed frame.
+    def _swap(self):
+        self.buffer, self._front = self._front, self.buffer
+        self.mvb, self._mvf = self._mvf, self.mvb
+        super().__init__(self.buffer, self.width, self.height, self.mode)
+        self.mvb[:] = self._mvf
+
+    # True while show_async is sending a frame.
+    def busy(self):
+        return self._busy
+
+    # Wait until any transfer started by show_async is complete.
+    async def wait(self):
+        while self._busy:
+            await asyncio.sleep_ms(0)
+
     def show(self, _cmd=b'\x15\x00\x5f\x75\x00\x3f'):  # Pre-allocate
+        if self._busy:
+            raise RuntimeError('Asynchronous transfer in progress.')
+        if not self._buffered:
+            return
+        if self._double:
+            self._swap()
+        if self._nrects:
+            for i in range(self._nrects):
+                r = self._rects[i]
+                self._send_rect(r[0], r[1], r[2], r[3])
+            self._nrects = 0
+            return
         self._write(_cmd, 0)
-        self._write(self.buffer, 1)
+        self._write(self._front, 1)
+
+    # Asynchronous show(). Data is sent in chunks of about chunk bytes with a
+    # yield to the scheduler after each so that other tasks run during the
+    # transfer. Without double buffering this returns when the transfer is
+    # complete and tasks must not draw to the framebuf until then. With double
+    # buffering the frame is sent by a background task and this returns at
+    # once: drawing of the next frame may proceed immediately.
+    async def show_async(self, chunk=1024):
+        await self.wait()  # Previous frame has been sent
+        if not self._buffered:
+            return
+        # Copy marked regions: tasks may mark more while the frame is sent.
+        rects = self._rects
+        regions = [tuple(rects[i]) for i in range(self._nrects)]
+        self._nrects = 0
+        if not regions:
+            regions.append((0, 0, self.width - 1, self.height - 1))
+        self._busy = True
+        if self._double:
+            self._swap()
+            asyncio.create_task(self._send_async(regions, chunk))
+        else:
+            await self._send_async(regions, chunk)
+
+    async def _send_async(self, regions, chunk):
+        spi = self.spi
+        mvb = self._mvf
+        w = self.width
+        cmd = self._cmd
+        try:
+            for x0, y0, x1, y1 in regions:
+                cmd[1] = x0
+                cmd[2] = x1
+                cmd[4] = y0
+                cmd[5] = y1
+                self._write(cmd, 0)
+                contiguous = x0 == 0 and x1 == w - 1
+                nbytes = x1 - x0 + 1
+                k = max(chunk // nbytes, 1)  # Rows per chunk
+                y = y0
+                while y <= y1:
+                    ye = min(y + k, y1 + 1)
+                    # Another task may have used the bus
+                    spi.init(baudrate=self.rate, polarity=1, phase=1)
+                    self.pindc(1)
+                    self.pincs(0)
+                    if contiguous:
+                        spi.write(mvb[y * w : ye * w])
+                    else:
+                        for row in range(y, ye):
+                            start = row * w + x0
+                            spi.write(mvb[start : start + nbytes])
+                    self.pincs(1)
+                    y = ye
+                    await asyncio.sleep_ms(0)
+        finally:
+            self._busy = False